@@ -1,9 +1,12 @@
 import bpy
 
-from bpy.props import FloatProperty
+from bpy.props import FloatProperty, BoolProperty
 from bpy.types import Operator
-from mathutils import Vector
-import functools
+import hashlib
+import itertools
+import numpy as np
+
+from collections import namedtuple
 
 bl_info = {
     "name": "TGOR Normal Merger",
@@ -16,6 +19,145 @@ bl_info = {
     "category": "Object"
     }
 
+def read_coords(data):
+    """Reads vertex coordinates into a numpy buffer"""
+    
+    coords = np.empty(len(data.vertices) * 3, dtype=np.float32)
+    data.vertices.foreach_get("co", coords)
+    return coords.reshape(-1, 3)
+
+# Everything the merge needs of a mesh in bulk, normals have to be calculated before
+MeshNormals = namedtuple("MeshNormals", ["coords", "vertex_normals", "loop_vertices", "loop_normals"])
+
+def read_normals(data):
+    """Reads coordinates, vertex normals, loop vertices and split normals into numpy buffers"""
+    
+    vertex_normals = np.empty(len(data.vertices) * 3, dtype=np.float32)
+    data.vertices.foreach_get("normal", vertex_normals)
+    
+    loop_vertices = np.empty(len(data.loops), dtype=np.int32)
+    data.loops.foreach_get("vertex_index", loop_vertices)
+    
+    loop_normals = np.empty(len(data.loops) * 3, dtype=np.float32)
+    data.loops.foreach_get("normal", loop_normals)
+    
+    return MeshNormals(read_coords(data), vertex_normals.reshape(-1, 3), loop_vertices, loop_normals.reshape(-1, 3))
+
+def boundary_vertices(data):
+    """Mask of vertices on open boundaries, meaning on an edge used by only one face"""
+    
+    loop_edges = np.empty(len(data.loops), dtype=np.int32)
+    data.loops.foreach_get("edge_index", loop_edges)
+    
+    edges = np.empty(len(data.edges) * 2, dtype=np.int32)
+    data.edges.foreach_get("vertices", edges)
+    edges = edges.reshape(-1, 2)
+    
+    # Every face uses each of its edges through exactly one loop
+    faces = np.bincount(loop_edges, minlength=len(edges))
+    mask = np.zeros(len(data.vertices), dtype=bool)
+    mask[edges[faces == 1].ravel()] = True
+    return mask
+
+def cluster_pairs(count, i, j):
+    """Labels count elements by cluster, elements connected through any (i, j) pair end up in the same cluster"""
+    
+    # Every element takes the smallest label it's connected to until nothing changes, halving paths on the way
+    label = np.arange(count)
+    while True:
+        low = np.minimum(label[i], label[j])
+        update = label.copy()
+        np.minimum.at(update, i, low)
+        np.minimum.at(update, j, low)
+        update = update[update]
+        if np.array_equal(update, label):
+            return label
+        label = update
+
+# Correspondences are stored on each target object per base object, under this prefix followed by the base name
+seam_property = "tgor_seam_"
+
+def seam_hash(reference, target, base_candidates, target_candidates, settings):
+    """Hash of everything a stored correspondence depends on, vertex counts and the coordinates of all candidates.
+    Candidates that weren't matched are part of it too, they might have moved onto the seam since.
+    """
+    
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.array([len(reference.coords), len(target.coords)], dtype=np.int64).tobytes())
+    h.update(repr(settings).encode())
+    for candidates in (base_candidates, target_candidates):
+        h.update(np.ascontiguousarray(candidates, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(reference.coords[base_candidates]).tobytes())
+    h.update(np.ascontiguousarray(target.coords[target_candidates]).tobytes())
+    return h.hexdigest()
+
+def load_seam(object, base, key):
+    """Stored correspondence of an object with a base, None if missing or if the seam changed since"""
+    
+    stored = object.get(seam_property + base.name)
+    if stored is None:
+        return None
+    
+    if stored["hash"] != key:
+        return None
+    
+    i = np.array(stored["base"], dtype=np.int64)
+    j = np.array(stored["target"], dtype=np.int64)
+    if len(i) != len(j):
+        return None
+    return i, j
+
+def store_seam(object, base, key, i, j):
+    """Stores a correspondence on the object as compact integer arrays"""
+    
+    object[seam_property + base.name] = {
+        "hash": key,
+        "base": i.astype(np.int32).tolist(),
+        "target": j.astype(np.int32).tolist(),
+    }
+
+merge_stats = {} # Seam vertex pairs and meshes of the last merge, read by the batch script
+
+def normalized(vectors):
+    """Normalizes rows, zero rows stay zero"""
+    
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(lengths > 0.0, lengths, 1.0)
+
+def coincident_vertices(reference, coords, tolerance):
+    """Pairs (i, j) of reference and coords vertices closer than tolerance.
+    coords get hashed onto a grid of tolerance sized cells, so every reference vertex is only compared to the 27 cells around it.
+    """
+    
+    if tolerance <= 0.0 or len(reference) == 0 or len(coords) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    origin = np.minimum(reference.min(axis=0), coords.min(axis=0))
+    cells = np.floor((coords - origin) / tolerance).astype(np.int64)
+    lookup = np.floor((reference - origin) / tolerance).astype(np.int64)
+    
+    # One padding cell per axis keeps neighbour keys from wrapping onto an existing cell
+    span = np.maximum(cells.max(axis=0), lookup.max(axis=0)) + 2
+    keys = (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+    order = np.argsort(keys, kind='stable')
+    ordered = keys[order]
+    lookup = (lookup[:, 0] * span[1] + lookup[:, 1]) * span[2] + lookup[:, 2]
+    
+    first, second = [], []
+    for dx, dy, dz in itertools.product((-1, 0, 1), repeat=3):
+        neighbours = lookup + (dx * span[1] + dy) * span[2] + dz
+        start = np.searchsorted(ordered, neighbours, side='left')
+        counts = np.searchsorted(ordered, neighbours, side='right') - start
+        
+        # Expand every reference vertex' range of candidates in the sorted keys
+        i = np.repeat(np.arange(len(reference)), counts)
+        j = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)]
+        close = np.linalg.norm(reference[i] - coords[j], axis=1) < tolerance
+        first.append(i[close])
+        second.append(j[close])
+    
+    return np.concatenate(first), np.concatenate(second)
+
 # Toggle edit operator
 class TGOR_OT_NormalMerge(Operator):
     """Merge normals between Active and selected objects """
@@ -23,44 +165,142 @@ class TGOR_OT_NormalMerge(Operator):
     bl_label = "Normal Merge Operator"
     bl_options = {'REGISTER', 'UNDO'}
     
-    tolerance: FloatProperty(default=0.0001)
+    tolerance: FloatProperty(default=0.0001, min=0.0)
+    boundaries: BoolProperty(default=True, description="Only merge vertices on open boundaries, disable for intentionally interpenetrating meshes")
+    cached: BoolProperty(default=True, description="Reuse seams found by earlier merges while their vertices haven't moved")
+    mutual: BoolProperty(default=False, description="Merge seams between all selected meshes in world space, not just between active and the others")
 
     @classmethod
     def poll(cls, context):
         return True
     
+    def correspondences(self, base, reference, base_candidates, object, target):
+        """Pairs of base and target vertices to merge, only seams are considered when merging boundaries"""
+        
+        if self.boundaries:
+            target_candidates = np.flatnonzero(boundary_vertices(object.data))
+        else:
+            target_candidates = np.arange(len(target.coords))
+        
+        # Re-merging after small edits finds the same seams again, skip the search if no candidate moved
+        key = seam_hash(reference, target, base_candidates, target_candidates, (self.tolerance, self.boundaries))
+        if self.cached:
+            seam = load_seam(object, base, key)
+            if seam is not None:
+                return seam
+        
+        i, j = self.search(reference, base_candidates, target, target_candidates)
+        store_seam(object, base, key, i, j)
+        return i, j
+    
+    def search(self, reference, base_candidates, target, target_candidates):
+        """Searches for coincident base and target vertices among candidates, mapped back to mesh vertices"""
+        
+        i, j = coincident_vertices(reference.coords[base_candidates], target.coords[target_candidates], self.tolerance)
+        return base_candidates[i], target_candidates[j]
+    
+    def merge_mutual(self, context):
+        """Averages normals of coincident vertices between any of the selected meshes"""
+        
+        objects = [o for o in context.selected_objects if o.type == 'MESH']
+        if len(objects) < 2:
+            self.report({'ERROR'}, "Select at least two mesh objects to merge.")
+            return {'FINISHED'}
+        
+        # Pool candidates of all objects in world space
+        meshes, coords, normals, owners, vertices = [], [], [], [], []
+        for index, object in enumerate(objects):
+            object.data.calc_normals_split()
+            mesh = read_normals(object.data)
+            meshes.append(mesh)
+            
+            candidates = np.flatnonzero(boundary_vertices(object.data)) if self.boundaries else np.arange(len(mesh.coords))
+            matrix = np.array(object.matrix_world, dtype=np.float32)
+            loop_counts = np.bincount(mesh.loop_vertices, minlength=len(mesh.coords))[candidates]
+            
+            coords.append(mesh.coords[candidates] @ matrix[:3, :3].T + matrix[:3, 3])
+            normals.append(normalized(mesh.vertex_normals[candidates] @ np.linalg.inv(matrix[:3, :3])) * loop_counts[:, None])
+            owners.append(np.full(len(candidates), index))
+            vertices.append(candidates)
+        
+        coords, normals, owners = np.concatenate(coords), np.concatenate(normals), np.concatenate(owners)
+        
+        # Clusters of coincident vertices, vertices of the same object are left split
+        i, j = coincident_vertices(coords, coords, self.tolerance)
+        other = owners[i] != owners[j]
+        label = cluster_pairs(len(coords), i[other], j[other])
+        
+        merged = np.zeros(len(coords), dtype=bool)
+        merged[i[other]] = True
+        merge_stats.update(seams=int(other.sum()) // 2, objects=len(objects))
+        
+        # Each cluster's normal is the average over the loops of all its vertices
+        sums = np.zeros((len(coords), 3))
+        np.add.at(sums, label, normals)
+        output = normalized(sums[label])
+        
+        start = 0
+        for object, mesh, candidates in zip(objects, meshes, vertices):
+            end = start + len(candidates)
+            
+            # Back to object space, normals transform with the transposed matrix there
+            matrix = np.array(object.matrix_world, dtype=np.float32)
+            vertex_merged = np.zeros(len(mesh.coords), dtype=bool)
+            vertex_merged[candidates] = merged[start:end]
+            vertex_output = np.zeros((len(mesh.coords), 3), dtype=np.float32)
+            vertex_output[candidates] = normalized(output[start:end] @ matrix[:3, :3])
+            
+            object.data.normals_split_custom_set(np.where(vertex_merged[mesh.loop_vertices, None], vertex_output[mesh.loop_vertices], mesh.loop_normals))
+            start = end
+        
+        return {'FINISHED'}
+    
     def execute(self, context):
         
+        if self.mutual:
+            return self.merge_mutual(context)
+        
         base = context.active_object
         if base.type == 'MESH':
             
             base.data.calc_normals_split()
-            output = [None] * len(base.data.vertices)
+            reference = read_normals(base.data)
             
             objects = [o for o in context.selected_objects if o.type == 'MESH' and not o is base]
             for object in objects:
                 object.data.calc_normals_split()
             
-            targets = [(o, list(map(lambda loop: loop.normal, o.data.loops))) for o in objects]
+            targets = [(o, read_normals(o.data)) for o in objects]
             if len(targets) > 0:
                 
-                for reference in base.data.vertices:
-                    
-                    others = [(normals, loop, vertex) for (object, normals) in targets for loop in object.data.loops if (reference.co - (vertex:=object.data.vertices[loop.vertex_index]).co).length < self.tolerance]
-                    if len(others) > 0:
-                        
-                        # Tuple unpacking not supported in python3 anymore, omega sadge
-                        normal = (functools.reduce(lambda v, t: v + t[2].normal, others, Vector()) / len(others) + reference.normal).normalized()
-                        
-                        output[reference.index] = normal
-                            
-                        for (normals, loop, vertex) in others:
-                            normals[loop.index] = normal
+                # Matching vertices of every target for each base vertex, found on a spatial hash instead of comparing everything
+                base_candidates = np.flatnonzero(boundary_vertices(base.data)) if self.boundaries else np.arange(len(reference.coords))
+                matches = [self.correspondences(base, reference, base_candidates, object, target) for (object, target) in targets]
+                merge_stats.update(seams=sum(len(i) for i, j in matches), objects=len(targets) + 1)
+                
+                # Every matching target loop adds its vertex normal to the base vertex it matches
+                sums = np.zeros((len(reference.coords), 3))
+                counts = np.zeros(len(reference.coords))
+                for (object, target), (i, j) in zip(targets, matches):
+                    loop_counts = np.bincount(target.loop_vertices, minlength=len(target.coords))[j]
+                    np.add.at(sums, i, target.vertex_normals[j] * loop_counts[:, None])
+                    np.add.at(counts, i, loop_counts)
+                
+                matched = counts > 0
+                output = normalized(sums / np.maximum(counts, 1)[:, None] + reference.vertex_normals)
+                
+                # Matched loops of targets take the merged normal of their base vertex
+                for (object, target), (i, j) in zip(targets, matches):
+                    merged = np.zeros(len(target.coords), dtype=bool)
+                    merged[j] = matched[i]
+                    vertex_output = np.zeros((len(target.coords), 3), dtype=np.float32)
+                    vertex_output[j] = output[i]
                     
-                for (object, normals) in targets:
+                    normals = np.where(merged[target.loop_vertices, None], vertex_output[target.loop_vertices], target.loop_normals)
                     object.data.normals_split_custom_set(normals)
                 
-                base.data.normals_split_custom_set(list(map(lambda loop: output[loop.vertex_index] if output[loop.vertex_index] else loop.normal, base.data.loops)))
+                normals = np.where(matched[reference.loop_vertices, None], output[reference.loop_vertices], reference.loop_normals)
+                base.data.normals_split_custom_set(normals)
                 
             else:
                 self.report({'ERROR'}, "No objects to merge with selected.")
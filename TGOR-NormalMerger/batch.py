@@ -0,0 +1,188 @@
+# Headless batch normal merging for the TGOR Normal Merger.
+#
+# Merges the objects listed in a JSON manifest for many .blend files, one background Blender process per file:
+#   python batch.py --blender /path/to/blender --jobs 4 --report report.json manifest.json
+#
+# The manifest lists merges per file, each either a base with the objects merged onto it or a mutual merge of all listed objects.
+# Paths are relative to the manifest, settings per merge default to the top level ones and those to the operator defaults:
+#   {
+#       "tolerance": 0.0001,
+#       "files": [
+#           {"path": "assets/shirt.blend", "merges": [{"base": "Body", "objects": ["Shirt", "Collar"]}]},
+#           {"path": "assets/outfit.blend", "merges": [{"objects": ["Boots", "Pants", "Belt"], "mutual": true, "boundaries": false}]}
+#       ]
+#   }
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+report_prefix = "TGOR_BATCH " # Marks lines the driver parses from Blender's output
+
+setting_keys = ("tolerance", "boundaries", "cached", "mutual")
+
+####################################################################################################
+############################################# BLENDER ##############################################
+####################################################################################################
+
+def ensure_addon():
+    """Registers the addon from this folder unless it's enabled already, returns its module"""
+
+    import bpy
+    import importlib.util
+
+    registered = bpy.types.Operator.bl_rna_get_subclass_py("OBJECT_OT_normal_merge")
+    if registered:
+        return sys.modules[registered.__module__]
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location(os.path.basename(folder), os.path.join(folder, "__init__.py"), submodule_search_locations=[folder])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    module.register()
+    return module
+
+def merge_file(args):
+    """Runs all merges the manifest lists for the currently opened file, prints one report line per merge"""
+
+    import bpy
+
+    addon = ensure_addon()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    # Find this file's entry, paths in the manifest are relative to it and might go through links
+    folder = os.path.dirname(os.path.abspath(args.manifest))
+    filepath = os.path.normcase(os.path.realpath(bpy.data.filepath))
+    entries = [entry for entry in manifest.get("files", []) if os.path.normcase(os.path.realpath(os.path.join(folder, entry["path"]))) == filepath]
+    merges = [merge for entry in entries for merge in entry.get("merges", [])]
+
+    if not entries:
+        print(report_prefix + json.dumps({"file": bpy.data.filepath, "error": "No manifest entry for this file"}))
+        return
+
+    view_layer = bpy.context.view_layer
+    for merge in merges:
+        report = {"file": bpy.data.filepath, "base": merge.get("base"), "objects": merge.get("objects", [])}
+
+        names = ([merge["base"]] if merge.get("base") else []) + merge.get("objects", [])
+        missing = [name for name in names if name not in view_layer.objects or view_layer.objects[name].type != 'MESH']
+        if missing:
+            report["error"] = "No meshes named " + ", ".join(missing) + " in the active view layer"
+            print(report_prefix + json.dumps(report))
+            continue
+
+        # The operator works on the selection with the base active
+        for obj in view_layer.objects:
+            obj.select_set(obj.name in names)
+        view_layer.objects.active = view_layer.objects[names[0]]
+
+        settings = {key: merge.get(key, manifest.get(key)) for key in setting_keys}
+        settings = {key: value for key, value in settings.items() if value is not None}
+
+        # Operator errors raise here, they shouldn't stop the other merges from running
+        addon.merge_stats.clear()
+        start = time.perf_counter()
+        try:
+            result = bpy.ops.object.normal_merge(**settings)
+            report["result"] = sorted(result)
+            report["seams"] = addon.merge_stats.get("seams", 0)
+        except RuntimeError as e:
+            report["error"] = str(e).strip()
+        report["seconds"] = time.perf_counter() - start
+
+        print(report_prefix + json.dumps(report))
+
+    if len(merges) > 0 and not args.dry_run:
+        bpy.ops.wm.save_mainfile()
+
+####################################################################################################
+############################################# DRIVER ###############################################
+####################################################################################################
+
+def run_file(args, path):
+    """Merges one file in a background Blender process, returns its reports and wall time"""
+
+    forwarded = ["--manifest", os.path.abspath(args.manifest)] + (["--dry-run"] if args.dry_run else [])
+
+    start = time.perf_counter()
+    process = subprocess.run([args.blender, "-b", path, "--python-exit-code", "1", "--python", os.path.abspath(__file__), "--"] + forwarded,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    seconds = time.perf_counter() - start
+
+    reports = [json.loads(line[len(report_prefix):]) for line in process.stdout.splitlines() if line.startswith(report_prefix)]
+    if process.returncode != 0:
+        reports.append({"file": path, "error": "Blender exited with code %d" % process.returncode})
+    return path, reports, seconds
+
+def run_files(args):
+    """Merges all files of the manifest in parallel, prints a timing summary and writes the report"""
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    folder = os.path.dirname(os.path.abspath(args.manifest))
+    paths = list(dict.fromkeys(os.path.join(folder, entry["path"]) for entry in manifest.get("files", [])))
+
+    total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(lambda path: run_file(args, path), paths))
+    total = time.perf_counter() - total
+
+    failed = 0
+    for path, reports, seconds in results:
+        print("%s (%.2fs)" % (path, seconds))
+        for report in reports:
+            name = report.get("base") or ("mutual" if report.get("objects") else "")
+            if "error" in report:
+                failed += 1
+                print("    %-32s ERROR %s" % (name, report["error"]))
+            else:
+                print("    %-32s %8d seams %8.2fs" % (name, report["seams"], report["seconds"]))
+
+    print("%d files in %.2fs, %d errors" % (len(results), total, failed))
+
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump({"seconds": total, "errors": failed,
+                       "files": [{"path": path, "seconds": seconds, "merges": reports} for path, reports, seconds in results]}, file, indent=4)
+
+    return 1 if failed > 0 else 0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Merge normals of objects in .blend files listed in a manifest")
+    parser.add_argument("manifest", nargs="?", help="JSON manifest of files and merges, only when running outside of Blender")
+    parser.add_argument("--manifest", dest="manifest_option", help="Manifest to merge the opened file from, used inside of Blender")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Files to process in parallel")
+    parser.add_argument("--report", help="Write per file and merge seam counts and timings to this JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="Don't save merged files")
+    args = parser.parse_args(argv)
+    args.manifest = args.manifest_option or args.manifest
+    if not args.manifest:
+        parser.error("a manifest is required")
+    return args
+
+def main():
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+
+    if bpy:
+        # Blender's own arguments come before --
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+        merge_file(parse_args(argv))
+        return 0
+
+    return run_files(parse_args(sys.argv[1:]))
+
+if __name__ == "__main__":
+    sys.exit(main())
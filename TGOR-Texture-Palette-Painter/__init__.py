@@ -13,12 +13,18 @@ bl_info = {
 
 import bpy
 import bpy.utils.previews
+import numpy as np
+import os
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from bpy.types import Operator, Panel, UIList, PropertyGroup
 from bpy.props import PointerProperty, StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty, FloatVectorProperty
 from bpy.props import CollectionProperty, PointerProperty
 
-icon_size = 4 # Preview icon density (higher setting will lag the editor)
+icon_size = 32 # Preview icon density, previews are only computed when the palette changes
 icon_xmargin = 1 # Horizontal sampling marging for preview icons in case of fuzzy borders
 icon_ymargin = 1 # Vertical sampling marging for preview icons in case of fuzzy borders
 
@@ -44,7 +50,245 @@ palette_grid_cells = [
 
 
 preview_collections = {}
-preview_dirty = True
+preview_checksums = {} # Image, size and cell checksums the previews were last computed from
+
+checksum_stride = 2 # Pixels between checksum samples per axis, strokes thinner than that can go unnoticed
+checksum_size = 2048 # Images larger than this per axis get sampled coarser and refreshed less often
+refresh_delay = 0.25 # Seconds to gather paint strokes for before refreshing previews
+
+tile_rows = 256 # Image rows decoded at once when analysing textures, bounds temporary memory on 8K textures
+exact_tolerance = 0.1 # Largest distance to a cell center in cell sizes for a texel to count as unblended
+lut_size = 1024 # Red and green steps of the remap lookup table, only decides which cell a texel goes to
+
+####################################################################################################
+############################################ PREVIEW ###############################################
+####################################################################################################
+
+def read_pixels(image):
+    """Reads all image pixels into a (height, width, 4) buffer, top row first like the palette grid"""
+    
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)[::-1]
+
+def bin_edges(size, cells, margin):
+    """Start and end of every icon texel's sample area along one axis, cell by cell inside the margins"""
+    
+    extent = size / cells
+    starts = np.arange(cells)[:, None] * extent + margin
+    steps = (extent - margin * 2) * np.arange(icon_size + 1) / icon_size
+    edges = np.floor(starts + steps).astype(np.int64)
+    
+    # Every texel samples at least one pixel, even on tiny palettes. The last pixel is only ever
+    # margin, leaving it out keeps all ends valid reduceat indices.
+    lower = np.clip(edges[:, :-1].ravel(), 0, size - 2)
+    upper = np.clip(edges[:, 1:].ravel(), lower + 1, size - 1)
+    return lower, upper
+
+def area_sums(pixels, lower, upper, axis):
+    """Sums of pixels over [lower, upper) ranges along an axis"""
+    
+    # reduceat sums from each index to the next, every other sum is the gap to the next range
+    indices = np.stack((lower, upper), axis=1).ravel()
+    sums = np.add.reduceat(pixels, indices, axis=axis, dtype=np.float64)
+    return np.take(sums, np.arange(0, len(indices), 2), axis=axis)
+
+def downsample(pixels, y0, y1, x0, x1):
+    """Area averages of pixels over every [y0, y1) x [x0, x1) rectangle, only reading the pixels in their bounds"""
+    
+    top, left = y0.min(), x0.min()
+    crop = pixels[top:y1.max() + 1, left:x1.max() + 1]
+    
+    sums = area_sums(area_sums(crop, y0 - top, y1 - top, 0), x0 - left, x1 - left, 1)
+    areas = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return (sums / areas[:, :, None]).astype(np.float32)
+
+def swatch_previews(pixels, rows, cols):
+    """Area averaged icons of every palette cell as (rows, cols, icon_size, icon_size, 4), top row first"""
+    
+    height, width = pixels.shape[:2]
+    y0, y1 = bin_edges(height, rows, icon_ymargin)
+    x0, x1 = bin_edges(width, cols, icon_xmargin)
+    
+    texels = downsample(pixels, y0, y1, x0, x1)
+    return texels.reshape(rows, icon_size, cols, icon_size, 4).transpose(0, 2, 1, 3, 4)
+
+def swatch_preview(pixels, rows, cols, y, x):
+    """Area averaged icon of one palette cell as (icon_size, icon_size, 4), top row first"""
+    
+    height, width = pixels.shape[:2]
+    y0, y1 = bin_edges(height, rows, icon_ymargin)
+    x0, x1 = bin_edges(width, cols, icon_xmargin)
+    
+    cell_y = slice(y * icon_size, (y + 1) * icon_size)
+    cell_x = slice(x * icon_size, (x + 1) * icon_size)
+    return downsample(pixels, y0[cell_y], y1[cell_y], x0[cell_x], x1[cell_x])
+
+def cell_checksums(pixels, rows, cols):
+    """Sum and sum of squares of a strided pixel sample in every palette cell as (rows, cols, 8)"""
+    
+    height, width = pixels.shape[:2]
+    stride = checksum_stride * max(1, max(height, width) // checksum_size)
+    sample = pixels[::stride, ::stride]
+    
+    # Cells cover the image without gaps, so every cell simply sums up to where the next starts.
+    # Reducing rows first keeps float64 buffers down to one row per cell.
+    starts_y = np.minimum(-(-np.floor(np.arange(rows) * height / rows) // stride), len(sample) - 1).astype(np.int64)
+    starts_x = np.minimum(-(-np.floor(np.arange(cols) * width / cols) // stride), sample.shape[1] - 1).astype(np.int64)
+    sums = np.add.reduceat(np.add.reduceat(sample, starts_y, axis=0, dtype=np.float64), starts_x, axis=1)
+    squares = np.add.reduceat(np.add.reduceat(np.square(sample), starts_y, axis=0, dtype=np.float64), starts_x, axis=1)
+    return np.concatenate((sums, squares), axis=2)
+
+def update_previews(image, full=True):
+    """Recomputes swatch icons from the image, only cells whose checksum changed unless full"""
+    
+    if "main" not in preview_collections or min(image.size) < 2:
+        return
+    icons = preview_collections["main"]
+    
+    cols = 4
+    rows = len(palette_grid_cells)
+    pixels = read_pixels(image)
+    
+    # Compare against what the icons were last computed from
+    checksums = cell_checksums(pixels, rows, cols)
+    previous = preview_checksums.get("main")
+    preview_checksums["main"] = (image.name, tuple(image.size), checksums)
+    
+    if full or previous is None or previous[:2] != (image.name, tuple(image.size)):
+        previews = swatch_previews(pixels, rows, cols)
+        changed = np.ones((rows, cols), dtype=bool)
+    else:
+        previews = None
+        changed = np.any(previous[2] != checksums, axis=2)
+    
+    for y, x in zip(*np.nonzero(changed)):
+        preview = previews[y, x] if previews is not None else swatch_preview(pixels, rows, cols, y, x)
+        
+        # Icons are stored bottom row first
+        icons["icon" + str(y) + str(x)].icon_pixels_float.foreach_set(preview[::-1].ravel())
+
+def refresh_previews():
+    """Updates changed previews for the current scene's palette, also works as one-shot timer"""
+    
+    scene = bpy.context.scene
+    if scene and scene.tgor_palette_image:
+        update_previews(scene.tgor_palette_image, full=False)
+    return None
+
+@bpy.app.handlers.persistent
+def on_palette_paint(scene, depsgraph):
+    
+    # Painting updates the image over and over, gather strokes before re-sampling
+    image = scene.tgor_palette_image
+    if image and not bpy.app.timers.is_registered(refresh_previews):
+        if any(isinstance(update.id, bpy.types.Image) and update.id.name == image.name for update in depsgraph.updates):
+            bpy.app.timers.register(refresh_previews, first_interval=refresh_delay * max(1, max(image.size) // checksum_size))
+
+####################################################################################################
+############################################ ANALYSIS ##############################################
+####################################################################################################
+
+def palette_centers(rows, cols):
+    """Red values painted for every column and green values for every row, red saturates on the last column"""
+    
+    red = np.minimum((np.arange(cols) + 0.5) / (cols - 1), 1.0)
+    green = (np.arange(rows) + 0.5) / rows
+    return red, green
+
+def decode_cells(red, green, rows, cols):
+    """Row and column of the nearest palette cell for every texel, and its distance to the cell center in cell sizes"""
+    
+    red_centers, green_centers = palette_centers(rows, cols)
+    x = np.searchsorted((red_centers[1:] + red_centers[:-1]) / 2, red)
+    y = np.searchsorted((green_centers[1:] + green_centers[:-1]) / 2, green)
+    distance = np.maximum(np.abs(red - red_centers[x]) * (cols - 1), np.abs(green - green_centers[y]) * rows)
+    return y, x, distance
+
+def pixel_tiles(pixels, width):
+    """Splits a flat pixel buffer into views of tile_rows image rows each, as (rows, width, 4)"""
+    
+    stride = tile_rows * width * 4
+    for start in range(0, len(pixels), stride):
+        yield pixels[start:start + stride].reshape(-1, width, 4)
+
+def remap_table(rows, cols, mapping, relative=False):
+    """Lookup table over (green, red) giving the new red and green for texels there, NaN where texels stay.
+    mapping gets the cell rows and columns of every table entry and returns a mask of entries to move and their new cells.
+    Relative tables hold how far texels move from their cell to the new one instead, keeping their offset to the center.
+    """
+    
+    steps = np.arange(lut_size) / (lut_size - 1)
+    green, red = np.meshgrid(steps, steps, indexing='ij')
+    y, x, distance = decode_cells(red.ravel(), green.ravel(), rows, cols)
+    moved, new_y, new_x = mapping(y, x, distance < 0.5)
+    
+    red_centers, green_centers = palette_centers(rows, cols)
+    table = np.full((lut_size * lut_size, 2), np.nan, dtype=np.float32)
+    table[moved, 0] = red_centers[new_x[moved]]
+    table[moved, 1] = green_centers[new_y[moved]]
+    if relative:
+        table[moved, 0] -= red_centers[x[moved]]
+        table[moved, 1] -= green_centers[y[moved]]
+    return table.reshape(lut_size, lut_size, 2)
+
+def remap_tile(tile, table, relative=False):
+    """Replaces (or offsets with a relative table) red and green of texels in place where the table says so, blue and alpha stay"""
+    
+    red = np.rint(np.clip(tile[:, :, 0], 0.0, 1.0) * (lut_size - 1)).astype(np.int32)
+    green = np.rint(np.clip(tile[:, :, 1], 0.0, 1.0) * (lut_size - 1)).astype(np.int32)
+    values = table[green, red]
+    moved = ~np.isnan(values[:, :, 0])
+    if relative:
+        tile[:, :, :2][moved] = np.clip(tile[:, :, :2][moved] + values[moved], 0.0, 1.0)
+    else:
+        tile[:, :, :2][moved] = values[moved]
+
+def remap_image(image, table, relative=False):
+    """Remaps all texels of an image with a lookup table, tiles run on a thread pool"""
+    
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    
+    # Tiles are views into the same buffer, numpy releases the GIL while working on them
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        list(pool.map(lambda tile: remap_tile(tile, table, relative), pixel_tiles(pixels, width)))
+    
+    image.pixels.foreach_set(pixels)
+    image.update()
+
+# Texel counts of a texture per palette cell as (rows, cols), and of texels not belonging to any used cell
+Coverage = namedtuple("Coverage", ["exact", "blended", "stray", "off_grid"])
+
+def palette_coverage(image, rows, cols):
+    """Decodes every texel of a palette painted image to its cell, tile by tile"""
+    
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    
+    used = np.array([[name != "" for (name, tooltip) in row] for row in palette_grid_cells]).ravel()
+    exact = np.zeros(rows * cols, dtype=np.int64)
+    blended = np.zeros(rows * cols, dtype=np.int64)
+    off_grid = 0
+    
+    for tile in pixel_tiles(pixels, width):
+        y, x, distance = decode_cells(tile[:, :, 0].ravel(), tile[:, :, 1].ravel(), rows, cols)
+        cells = y * cols + x
+        
+        # Further than half a cell from any center can't come from painting or blending neighbours
+        on_grid = distance < 0.5
+        off_grid += int(np.count_nonzero(~on_grid))
+        exact += np.bincount(cells[on_grid & (distance <= exact_tolerance)], minlength=rows * cols)
+        blended += np.bincount(cells[on_grid & (distance > exact_tolerance)], minlength=rows * cols)
+    
+    # Texels of cells without a button were never painted on purpose
+    stray = int(exact[~used].sum() + blended[~used].sum())
+    exact[~used] = 0
+    blended[~used] = 0
+    return Coverage(exact.reshape(rows, cols), blended.reshape(rows, cols), stray, off_grid)
 
 ####################################################################################################
 ########################################### OPERATOR ###############################################
@@ -70,6 +314,71 @@ class TGOR_OT_PaletteColorSet(Operator):
         context.tool_settings.image_paint.brush.blend = 'MIX'
         return {'FINISHED'}
 
+# Enum items of all palette cells with a button
+palette_cell_items = [(name, name, tooltip) for row in palette_grid_cells for (name, tooltip) in row if name != ""]
+
+class TGOR_OT_PaletteRemap(Operator):
+    bl_label = "Palette Remap"
+    bl_idname = "scene.tgor_palette_remap_operator"
+    bl_description = "Move texels of a palette painted texture from one cell to another, or snap all of them to their nearest cell"
+    
+    image: StringProperty(description="Palette painted texture to change")
+    mode: EnumProperty(
+        items=(
+            ('REMAP', 'Remap', "Move texels of the source cell to the target cell, keeping blends"),
+            ('SNAP', 'Snap', "Move every texel to its nearest cell center, removing blends between cells")
+        ),
+        name="Mode",
+        default='REMAP')
+    source: EnumProperty(items=palette_cell_items, name="Source")
+    target: EnumProperty(items=palette_cell_items, name="Target")
+    
+    def check(self, context):
+        return True
+    
+    def invoke(self, context, event):
+        
+        # Default to what's being painted on
+        canvas = context.tool_settings.image_paint.canvas
+        if self.image not in bpy.data.images and canvas:
+            self.image = canvas.name
+        
+        wm = context.window_manager
+        return wm.invoke_props_dialog(self)
+    
+    def draw(self, context):
+        layout = self.layout
+        layout.prop_search(self, "image", bpy.data, "images", text="", icon='IMAGE_DATA')
+        layout.prop(self, "mode", expand=True)
+        if self.mode == 'REMAP':
+            row = layout.row()
+            row.prop(self, "source", text="")
+            row.prop(self, "target", text="")
+    
+    def execute(self, context):
+        
+        image = bpy.data.images.get(self.image)
+        if not image or min(image.size) == 0:
+            self.report({'ERROR_INVALID_INPUT'}, "No image with pixels selected")
+            return {'CANCELLED'}
+        
+        cols = 4
+        rows = len(palette_grid_cells)
+        cells = {name: (y, x) for y, row in enumerate(palette_grid_cells) for x, (name, tooltip) in enumerate(row)}
+        
+        if self.mode == 'SNAP':
+            mapping = lambda y, x, on_grid: (on_grid, y, x)
+        else:
+            source, target = cells[self.source], cells[self.target]
+            mapping = lambda y, x, on_grid: (on_grid & (y == source[0]) & (x == source[1]), np.full_like(y, target[0]), np.full_like(x, target[1]))
+        
+        # Remapped texels keep their offset to the center so blends move along, snapping flattens them
+        relative = self.mode == 'REMAP'
+        start = time.perf_counter()
+        remap_image(image, remap_table(rows, cols, mapping, relative), relative)
+        self.report({'INFO'}, "Remapped %s in %.2fs" % (image.name, time.perf_counter() - start))
+        return {'FINISHED'}
+
 class TGOR_OT_PaletteColorAdd(Operator):
     bl_label = "Palette Color Add"
     bl_idname = "scene.tgor_palette_add_operator"
@@ -96,6 +405,62 @@ class TGOR_OT_PaletteColorSubtract(Operator):
         context.tool_settings.image_paint.brush.blend = 'SUB'
         return {'FINISHED'}
 
+class TGOR_OT_PaletteCoverage(Operator):
+    bl_label = "Palette Coverage"
+    bl_idname = "scene.tgor_palette_coverage_operator"
+    bl_description = "Count texels of a palette painted texture per palette cell, written to a text block"
+    
+    image: StringProperty(description="Palette painted texture to analyse")
+    
+    def check(self, context):
+        return True
+    
+    def invoke(self, context, event):
+        
+        # Default to what's being painted on
+        canvas = context.tool_settings.image_paint.canvas
+        if self.image not in bpy.data.images and canvas:
+            self.image = canvas.name
+        
+        wm = context.window_manager
+        return wm.invoke_props_dialog(self)
+    
+    def draw(self, context):
+        self.layout.prop_search(self, "image", bpy.data, "images", text="", icon='IMAGE_DATA')
+    
+    def execute(self, context):
+        
+        image = bpy.data.images.get(self.image)
+        if not image or min(image.size) == 0:
+            self.report({'ERROR_INVALID_INPUT'}, "No image with pixels selected")
+            return {'CANCELLED'}
+        
+        cols = 4
+        rows = len(palette_grid_cells)
+        
+        start = time.perf_counter()
+        coverage = palette_coverage(image, rows, cols)
+        seconds = time.perf_counter() - start
+        
+        texels = image.size[0] * image.size[1]
+        lines = ["Palette coverage of %s (%dx%d, %.2fs)" % (image.name, image.size[0], image.size[1], seconds), ""]
+        lines.append("%-6s %-48s %10s %8s %8s" % ("Cell", "Name", "Texels", "Share", "Blended"))
+        for y, row in enumerate(palette_grid_cells):
+            for x, (name, tooltip) in enumerate(row):
+                total = coverage.exact[y, x] + coverage.blended[y, x]
+                if name != "" and total > 0:
+                    lines.append("%-6s %-48s %10d %7.2f%% %7.2f%%" % (name, tooltip, total, 100.0 * total / texels, 100.0 * coverage.blended[y, x] / total))
+        
+        lines.append("")
+        lines.append("Stray texels on unused cells: %d (%.2f%%)" % (coverage.stray, 100.0 * coverage.stray / texels))
+        lines.append("Off-grid texels: %d (%.2f%%)" % (coverage.off_grid, 100.0 * coverage.off_grid / texels))
+        
+        text = bpy.data.texts.get("TGOR Palette Coverage") or bpy.data.texts.new("TGOR Palette Coverage")
+        text.from_string("\n".join(lines))
+        
+        self.report({'INFO'}, "Analysed %s in %.2fs, %d stray and %d off-grid texels, see text TGOR Palette Coverage" % (image.name, seconds, coverage.stray, coverage.off_grid))
+        return {'FINISHED'}
+
 ####################################################################################################
 ############################################# PANEL ################################################
 ####################################################################################################
@@ -110,7 +475,6 @@ class TGOR_PT_PalettePanel(Panel):
     
 #   Draw the menu elements
     def draw(self, context):
-        global preview_dirty
         layout = self.layout
         
         layout.template_ID(context.scene, "tgor_palette_image", new="image.new", open="image.open")
@@ -119,6 +483,9 @@ class TGOR_PT_PalettePanel(Panel):
         row = layout.row(align=True)
         row.operator("scene.tgor_palette_add_operator", text="Add", icon="ADD")
         row.operator("scene.tgor_palette_subtract_operator", text="Subtract", icon="REMOVE")
+        row = layout.row(align=True)
+        row.operator("scene.tgor_palette_remap_operator", text="Remap", icon="ARROW_LEFTRIGHT")
+        row.operator("scene.tgor_palette_coverage_operator", text="Coverage", icon="VIEWZOOM")
         
         cols = 4
         rows = len(palette_grid_cells)
@@ -130,25 +497,9 @@ class TGOR_PT_PalettePanel(Panel):
             for x, (name, tooltip) in enumerate(row):
                 if name != "":
                     
-                    # Generate previews if available
+                    # Show previews if available, they're computed whenever the palette changes
                     if preview:
-                        
                         icon = icons["icon" + str(y) + str(x)]
-                            
-                        if preview_dirty:
-                            sx = (preview.size[0] / cols)
-                            sy = (preview.size[1] / rows)
-                            
-                            for cx in range(0,icon_size):
-                                for cy in range(0, icon_size):
-                                    
-                                    px = int(sx * x + icon_xmargin + (sx - icon_xmargin * 2) * cx / icon_size)
-                                    py = int(sy * y + icon_ymargin + (sy - icon_ymargin * 2) * cy / icon_size)
-                                    pi = ((preview.size[1]-1 - py) * preview.size[0] + px) * 4
-                                    
-                                    ci = ((icon_size-1 - cy) * icon_size + cx) * 4
-                                    icon.icon_pixels_float[ci:ci+4] = preview.pixels[pi:pi+4]
-                            
                         ops = grid.operator("scene.tgor_palette_set_operator", text=name, icon_value=icon.icon_id)
                     else:
                         ops = grid.operator("scene.tgor_palette_set_operator", text=name)
@@ -156,8 +507,6 @@ class TGOR_PT_PalettePanel(Panel):
                     # Sample in the middle of each swatch
                     ops.color = [(float(x) + 0.5) / (cols-1), (float(y) + 0.5) / rows, 0.0]
                     ops.tooltip = tooltip
-        
-        preview_dirty = False
 
     @classmethod
     def poll(cls, context):
@@ -166,24 +515,30 @@ class TGOR_PT_PalettePanel(Panel):
 classes = (
     TGOR_PT_PalettePanel,
     TGOR_OT_PaletteColorSet,
+    TGOR_OT_PaletteRemap,
     TGOR_OT_PaletteColorAdd,
-    TGOR_OT_PaletteColorSubtract
+    TGOR_OT_PaletteColorSubtract,
+    TGOR_OT_PaletteCoverage
 )
 
 def on_palette_change(self, context):
-    global preview_dirty
-    preview_dirty = True
+    if self.tgor_palette_image:
+        update_previews(self.tgor_palette_image)
+
+@bpy.app.handlers.persistent
+def load_previews(dummy):
+    scene = bpy.context.scene
+    if scene and scene.tgor_palette_image:
+        update_previews(scene.tgor_palette_image)
 
 # Register
 def register():
-    global preview_dirty
 
     from bpy.utils import register_class
     for c in classes:
         register_class(c)
     
     bpy.types.Scene.tgor_palette_image = PointerProperty(type=bpy.types.Image, update=on_palette_change)
-    preview_dirty = True
         
     icons = bpy.utils.previews.new()
     
@@ -197,9 +552,19 @@ def register():
             icon.is_icon_custom = True
     
     preview_collections["main"] = icons
+    
+    # Context isn't available while registering, fill in previews right after
+    bpy.app.handlers.load_post.append(load_previews)
+    bpy.app.handlers.depsgraph_update_post.append(on_palette_paint)
+    bpy.app.timers.register(refresh_previews, first_interval=0.0)
 
 def unregister():
     
+    bpy.app.handlers.depsgraph_update_post.remove(on_palette_paint)
+    bpy.app.handlers.load_post.remove(load_previews)
+    if bpy.app.timers.is_registered(refresh_previews):
+        bpy.app.timers.unregister(refresh_previews)
+    
     preview_collections["main"] = {}
     
     for icons in preview_collections.values():
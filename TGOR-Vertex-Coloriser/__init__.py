@@ -12,35 +12,714 @@ bl_info = {
 
 import bpy
 
+from bpy.app.handlers import persistent
 from bpy.types import Operator, Panel, UIList, PropertyGroup
 from bpy.props import CollectionProperty, PointerProperty, StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty, FloatVectorProperty
-from mathutils import Vector
+import numpy as np
+import hashlib
+import json
 import math
+import os
+import sys
+import threading
+import time
+
+from collections import namedtuple, OrderedDict
+
+# Path finding is imported from the addon folder directly, worker processes have to import it without bpy
+if os.path.dirname(__file__) not in sys.path:
+    sys.path.append(os.path.dirname(__file__))
+if "tgor_colorizer_paths" in locals():
+    import importlib
+    importlib.reload(tgor_colorizer_paths)
+import tgor_colorizer_paths
+from tgor_colorizer_paths import distance_fields, cluster_vertices, proxy_seeds, stitch_meshes
+
+# Harmonic weighting and geodesics need sparse factorization from scipy, which isn't shipped with Blender
+try:
+    from scipy.sparse import coo_matrix, csr_matrix, diags, identity
+    from scipy.sparse.csgraph import connected_components
+    from scipy.sparse.linalg import splu
+except ImportError:
+    splu = None
 
 ####################################################################################################
 ####################################### PROPERTY GROUP #############################################
 ####################################################################################################
 
+live_delay = 0.05 # Seconds to gather edits for before live re-blending
+
+def on_colorization_change(self, context):
+    
+    # Edits arriving while a re-blend is scheduled are picked up by it
+    if context.scene.tgor_vertex_live and not bpy.app.timers.is_registered(live_blend):
+        bpy.app.timers.register(live_blend, first_interval=live_delay)
+
 class TGOR_VertexColorizationEntry(PropertyGroup):
     
     enabled: BoolProperty(default=True)
-    red: FloatProperty(default=0.0, min=0.0, max=1.0)
-    green: FloatProperty(default=0.0, min=0.0, max=1.0)
-    blue: FloatProperty(default=0.0, min=0.0, max=1.0)
-    alpha: FloatProperty(default=1.0, min=0.0, max=1.0)
-    UVu: FloatProperty(default=0.0, min=0.0, max=1.0)
-    UVv: FloatProperty(default=0.0, min=0.0, max=1.0)
-    weight: FloatProperty(default=1.0, min=0.01, max=5.0)
+    red: FloatProperty(default=0.0, min=0.0, max=1.0, update=on_colorization_change)
+    green: FloatProperty(default=0.0, min=0.0, max=1.0, update=on_colorization_change)
+    blue: FloatProperty(default=0.0, min=0.0, max=1.0, update=on_colorization_change)
+    alpha: FloatProperty(default=1.0, min=0.0, max=1.0, update=on_colorization_change)
+    UVu: FloatProperty(default=0.0, min=0.0, max=1.0, update=on_colorization_change)
+    UVv: FloatProperty(default=0.0, min=0.0, max=1.0, update=on_colorization_change)
+    weight: FloatProperty(default=1.0, min=0.01, max=5.0, update=on_colorization_change)
     
 class TGOR_VertexColorizationOptions(PropertyGroup):
     
-    red: BoolProperty(default=True)
-    green: BoolProperty(default=True)
-    blue: BoolProperty(default=False)
-    alpha: BoolProperty(default=False)
-    UVu: BoolProperty(default=False)
-    UVv: BoolProperty(default=False)
+    red: BoolProperty(default=True, update=on_colorization_change)
+    green: BoolProperty(default=True, update=on_colorization_change)
+    blue: BoolProperty(default=False, update=on_colorization_change)
+    alpha: BoolProperty(default=False, update=on_colorization_change)
+    UVu: BoolProperty(default=False, update=on_colorization_change)
+    UVv: BoolProperty(default=False, update=on_colorization_change)
+    
+####################################################################################################
+########################################### MESH ARRAYS ############################################
+####################################################################################################
+
+def read_mesh(data):
+    """Reads vertex coordinates, triangle vertices and loop vertices into numpy buffers"""
+    
+    data.calc_loop_triangles()
+    
+    coords = np.empty(len(data.vertices) * 3, dtype=np.float32)
+    data.vertices.foreach_get("co", coords)
+    
+    triangles = np.empty(len(data.loop_triangles) * 3, dtype=np.int32)
+    data.loop_triangles.foreach_get("vertices", triangles)
+    
+    loops = np.empty(len(data.loops), dtype=np.int32)
+    data.loops.foreach_get("vertex_index", loops)
+    
+    return coords.reshape(-1, 3), triangles.reshape(-1, 3), loops
+
+def write_layers(vertex_color, vertex_uv, loops, C, options):
+    """Writes per vertex output (RGBA + UV) to every loop of color and uv layer, only touching masked channels.
+    Colors are skipped without a color layer, for when they go to a color attribute instead.
+    """
+    
+    color_mask = np.array([options.red, options.green, options.blue, options.alpha])
+    if vertex_color and color_mask.any():
+        colors = np.empty(len(loops) * 4, dtype=np.float32)
+        vertex_color.data.foreach_get("color", colors)
+        colors = colors.reshape(-1, 4)
+        colors[:, color_mask] = C[loops, :4][:, color_mask]
+        vertex_color.data.foreach_set("color", colors.ravel())
+    
+    uv_mask = np.array([options.UVu, options.UVv])
+    if uv_mask.any():
+        uvs = np.empty(len(loops) * 2, dtype=np.float32)
+        vertex_uv.data.foreach_get("uv", uvs)
+        uvs = uvs.reshape(-1, 2)
+        uvs[:, uv_mask] = C[loops, 4:][:, uv_mask]
+        vertex_uv.data.foreach_set("uv", uvs.ravel())
+
+def write_point_colors(attribute, C, options):
+    """Writes per vertex output RGBA to a point domain color attribute, only touching masked channels"""
+    
+    color_mask = np.array([options.red, options.green, options.blue, options.alpha])
+    if color_mask.any():
+        colors = np.empty(len(C) * 4, dtype=np.float32)
+        attribute.data.foreach_get("color", colors)
+        colors = colors.reshape(-1, 4)
+        colors[:, color_mask] = C[:, :4][:, color_mask]
+        attribute.data.foreach_set("color", colors.ravel())
+
+def point_color_attribute(data, name, data_type):
+    """Existing point color attribute of that name or a new one, None if the name is taken by something else"""
+    
+    attribute = data.attributes.get(name)
+    if attribute is None:
+        return data.attributes.new(name, data_type, 'POINT')
+    if attribute.domain != 'POINT' or attribute.data_type not in ('FLOAT_COLOR', 'BYTE_COLOR'):
+        return None
+    return attribute
+
+# Vertex group weights as sparse (vertex x group) matrix in coordinate form
+Weights = namedtuple("Weights", ["vertices", "groups", "weights"])
+
+def read_group_weights(obj, names):
+    """Reads the weights of all given vertex groups in one pass over the vertices, groups are numbered by order in names"""
+    
+    columns = {obj.vertex_groups[name].index: i for i, name in enumerate(names) if name in obj.vertex_groups}
+    
+    vertices = []
+    groups = []
+    weights = []
+    for vertex in obj.data.vertices:
+        for element in vertex.groups:
+            column = columns.get(element.group)
+            if column is not None:
+                vertices.append(vertex.index)
+                groups.append(column)
+                weights.append(element.weight)
+    
+    return Weights(np.array(vertices, dtype=np.int32), np.array(groups, dtype=np.int32), np.array(weights, dtype=np.float32))
+
+####################################################################################################
+############################################## CACHE ###############################################
+####################################################################################################
+
+cache_budget = 256 * 1024 * 1024 # Memory for cached distance fields in bytes, least recently used fields are dropped first
+
+distance_cache = OrderedDict() # Distance field per mesh and seed hash
+object_cache_keys = {} # Distance field keys last used by each object, saved alongside the .blend
+
+# Jobs on worker threads fill the caches while handlers on the main thread save or clear them
+cache_lock = threading.RLock()
+
+def hash_arrays(*arrays):
+    """Cheap content hash over numpy arrays"""
+    
+    h = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(str((array.dtype, array.shape)).encode())
+        h.update(array.data)
+    return h.hexdigest()
+
+def cache_get(key):
+    """Returns a cached distance field or None, marks it as most recently used"""
+    
+    with cache_lock:
+        d = distance_cache.get(key)
+        if d is not None:
+            distance_cache.move_to_end(key)
+        return d
+
+def cache_put(key, d):
+    """Caches a distance field, dropping least recently used ones beyond cache_budget"""
+    
+    with cache_lock:
+        distance_cache[key] = d
+        distance_cache.move_to_end(key)
+        
+        size = sum(value.nbytes for value in distance_cache.values())
+        while size > cache_budget and len(distance_cache) > 1:
+            _, value = distance_cache.popitem(last=False)
+            size -= value.nbytes
+
+def cache_path():
+    """Sidecar file next to the current .blend, None if it was never saved"""
+    
+    if not bpy.data.filepath:
+        return None
+    return os.path.splitext(bpy.data.filepath)[0] + ".colorizer.npz"
+
+@persistent
+def save_distance_cache(dummy):
+    path = cache_path()
+    if not path:
+        return
+    
+    # Only keep fields of objects that are still around and fully cached
+    with cache_lock:
+        objects = {name: keys for name, keys in object_cache_keys.items()
+                   if name in bpy.data.objects and all(key in distance_cache for key in keys)}
+        fields = {key: distance_cache[key] for keys in objects.values() for key in keys}
+    if len(objects) == 0:
+        return
+    
+    np.savez(path, objects=np.array(json.dumps(objects)), **fields)
+
+@persistent
+def load_distance_cache(dummy):
+    blend_states.clear()
+    with cache_lock:
+        object_cache_keys.clear()
+    
+    path = cache_path()
+    if not path or not os.path.exists(path):
+        return
+    
+    with np.load(path) as file, cache_lock:
+        object_cache_keys.update(json.loads(str(file["objects"])))
+        for key in file.files:
+            if key != "objects":
+                cache_put(key, file[key])
+
+def group_distances(D, name, coords, triangles, seeds, limit, workers=1, method='GRAPH'):
+    """Fills distance fields D (groups x vertices) from every group's (vertices, offsets) seeds, reusing cached fields of unchanged groups.
+    Generator yielding the fraction of work done after building the graph and while computing groups.
+    """
+    
+    mesh_key = method + hash_arrays(coords, triangles)
+    keys = [mesh_key + hash_arrays(vertices, offsets, np.float32(limit)) for vertices, offsets in seeds]
+    
+    missing = []
+    for i, key in enumerate(keys):
+        d = cache_get(key)
+        if d is None:
+            missing.append(i)
+        else:
+            D[i] = d
+    
+    # Geodesics prefactor once per mesh, then every group is just two back-substitutions
+    if method == 'HEAT' and len(missing) > 0:
+        solver = geodesic_solver(coords, triangles)
+        yield 1.0 / (len(missing) + 1)
+        
+        for done, i in enumerate(missing, 2):
+            D[i] = geodesic_distances(solver, seeds[i][0], limit)
+            cache_put(keys[i], D[i].copy())
+            yield done / (len(missing) + 1)
+    
+    # Only build the graph if anything actually has to be computed
+    elif len(missing) > 0:
+        finished = 0
+        for i in distance_fields(D, missing, coords, triangles, [seeds[i] for i in missing], limit, workers):
+            if i is not None:
+                cache_put(keys[i], D[i].copy())
+                finished += 1
+            yield (finished + 1) / (len(missing) + 1)
+    
+    # Only once every group is done, a cancelled run would keep the object from being saved at all
+    with cache_lock:
+        object_cache_keys[name] = keys
+
+####################################################################################################
+############################################ BLENDING ##############################################
+####################################################################################################
+
+# Color (RGBA + UV) of vertices that couldn't be blended
+default_color = (0.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+def blend_polynomial(D, W, O):
+    """Blends group colors O (groups x 6) by group distances D (groups x vertices) scaled by group weights W
+    
+    Every group contributes with the product of e / (d + e) over all other groups, d and e being the weighted
+    distances to itself and the other group. The own factor is always 1/2, so instead of excluding it we take
+    the full product and double it, which is done in log space to keep it from underflowing with many groups.
+    """
+    
+    E = np.maximum(D / W[:, None], 1e-12) # Avoid log of zero
+    S = np.log(E).sum(axis=0) + math.log(2.0)
+    
+    C = np.zeros((D.shape[1], 6))
+    for g in range(len(E)):
+        f = np.exp(S - np.log(E[g] + E).sum(axis=0))
+        C += f[:, None] * O[g]
+    return C
+
+def blend_laplacian(D, W, O):
+    """Blends group colors O (groups x 6) by inverse group distances D (groups x vertices) scaled by group weights W"""
+    
+    F = W[:, None] / np.maximum(D, 0.0001) # Avoid division by zero
+    w = F.sum(axis=0)
+    
+    C = np.tile(default_color, (D.shape[1], 1))
+    valid = w > 0.0001
+    C[valid] = (F[:, valid].T @ O) / w[valid, None]
+    return C
+
+def group_colors(colorizations, names):
+    """Colors (groups x 6) and weights of the given groups"""
+    
+    O = np.array([(colorizations[name].red, colorizations[name].green, colorizations[name].blue, colorizations[name].alpha, colorizations[name].UVu, colorizations[name].UVv) for name in names]).reshape(-1, 6)
+    W = np.array([colorizations[name].weight for name in names])
+    return O, W
+
+def blend_colors(D, W, O, owner, weighting, solver=None, proxy=None):
+    """Output colors for every vertex, group members take their group's color and everything else is blended"""
+    
+    # Harmonic weighting doesn't use distances or weights, it solves for all vertices at once
+    if weighting == 'HARM':
+        if proxy is None:
+            return harmonic_blend(solver, O[owner[solver.pinned]])
+        
+        # Approximated vertices take their cluster's color
+        C = harmonic_blend(solver, O[proxy.owner[solver.pinned]])[proxy.clusters]
+        assigned = owner >= 0
+        C[assigned] = O[owner[assigned]]
+        return C
+    
+    # Build vertex colors for yet unassigned vertices
+    C = np.tile(default_color, (len(owner), 1))
+    U = np.flatnonzero(owner < 0)
+    if weighting == 'POLY':
+        C[U] = blend_polynomial(D[:, U], W, O)
+    else:
+        C[U] = blend_laplacian(D[:, U], W, O)
+    
+    # Vertices inside a group take its color
+    assigned = owner >= 0
+    C[assigned] = O[owner[assigned]]
+    return C
+
+####################################################################################################
+############################################ HARMONIC ##############################################
+####################################################################################################
+
+harmonic_cache_size = 4 # Factorizations kept around for re-blending, they can get large on dense meshes
+harmonic_cache = OrderedDict() # Harmonic solver per mesh and pinned vertices hash
+
+# Laplacian restricted to free vertices in factorized form, together with the coupling to pinned vertices
+HarmonicSolver = namedtuple("HarmonicSolver", ["lu", "free", "pinned", "coupling", "regularization"])
+
+def cotangent_laplacian(coords, triangles):
+    """Sparse cotangent Laplacian, negative weights of obtuse triangles are clamped so colors stay inside group range"""
+    
+    count = len(coords)
+    coords = coords.astype(np.float64)
+    
+    rows = []
+    cols = []
+    weights = []
+    for k in range(3):
+        
+        # Each edge gets half the cotangent of the angle opposite to it
+        i, j, o = triangles[:, k], triangles[:, (k + 1) % 3], triangles[:, (k + 2) % 3]
+        a = coords[i] - coords[o]
+        b = coords[j] - coords[o]
+        cot = np.einsum('ij,ij->i', a, b) / np.maximum(np.linalg.norm(np.cross(a, b), axis=1), 1e-12)
+        rows += [i, j]
+        cols += [j, i]
+        weights += [0.5 * cot, 0.5 * cot]
+    
+    A = coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(count, count)).tocsr()
+    A.data = np.maximum(A.data, 0.0)
+    return diags(np.asarray(A.sum(axis=1)).ravel()) - A
+
+def harmonic_solver(coords, triangles, pinned):
+    """Factorizes the Laplacian for the given pinned vertices once per mesh, later calls with the same input are cached"""
+    
+    key = hash_arrays(coords, triangles, pinned)
+    with cache_lock:
+        solver = harmonic_cache.get(key)
+        if solver is not None:
+            harmonic_cache.move_to_end(key)
+            return solver
+    
+    L = cotangent_laplacian(coords, triangles)
+    free = np.setdiff1d(np.arange(len(coords)), pinned)
+    
+    # Tiny pull towards the default color so parts without any pinned vertex still have a solution
+    regularization = 1e-8 * max(L.diagonal().mean(), 1e-12)
+    
+    rows = L[free]
+    lu = splu((rows[:, free] + regularization * identity(len(free))).tocsc())
+    solver = HarmonicSolver(lu, free, pinned, rows[:, pinned].tocsr(), regularization)
     
+    with cache_lock:
+        harmonic_cache[key] = solver
+        while len(harmonic_cache) > harmonic_cache_size:
+            harmonic_cache.popitem(last=False)
+    return solver
+
+def harmonic_blend(solver, values):
+    """Output colors of the harmonic interpolation of the pinned vertices' values (pinned x 6), one solve for all channels"""
+    
+    C = np.empty((len(solver.free) + len(solver.pinned), 6))
+    C[solver.pinned] = values
+    if len(solver.free) > 0:
+        rhs = solver.regularization * np.asarray(default_color) - solver.coupling @ values
+        C[solver.free] = solver.lu.solve(rhs)
+    return C
+
+####################################################################################################
+############################################ GEODESICS #############################################
+####################################################################################################
+
+heat_time_factor = 1.0 # Heat diffusion time in squared mean edge lengths, higher is smoother but less accurate
+
+geodesic_cache = OrderedDict() # Geodesic solver per mesh hash, shares harmonic_cache_size
+
+# Prefactored heat and poisson systems of the heat method (Crane et al. 2013) together with the face gradient
+GeodesicSolver = namedtuple("GeodesicSolver", ["heat", "poisson", "gradient", "areas", "components"])
+
+def face_gradient(coords, triangles):
+    """Sparse (faces * 3 x vertices) operator taking per vertex values to their gradient on each face, and the face areas"""
+    
+    coords = coords.astype(np.float64)
+    p = coords[triangles]
+    normals = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    double_areas = np.maximum(np.linalg.norm(normals, axis=1), 1e-12)
+    normals /= double_areas[:, None]
+    
+    # Gradient of each corner's hat function is the opposite edge turned inwards, scaled by 1 / 2A
+    rows = []
+    cols = []
+    values = []
+    faces = np.arange(len(triangles))
+    for k in range(3):
+        edge = p[:, (k + 2) % 3] - p[:, (k + 1) % 3]
+        g = np.cross(normals, edge) / double_areas[:, None]
+        for axis in range(3):
+            rows.append(faces * 3 + axis)
+            cols.append(triangles[:, k])
+            values.append(g[:, axis])
+    
+    G = coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(len(triangles) * 3, len(coords))).tocsr()
+    return G, 0.5 * double_areas
+
+def geodesic_solver(coords, triangles):
+    """Prefactors the heat method for a mesh, later calls with the same mesh are cached"""
+    
+    key = hash_arrays(coords, triangles)
+    with cache_lock:
+        solver = geodesic_cache.get(key)
+        if solver is not None:
+            geodesic_cache.move_to_end(key)
+            return solver
+    
+    count = len(coords)
+    G, areas = face_gradient(coords, triangles)
+    
+    # Cotangent Laplacian as the normal equations of the gradient, so both solves agree on conventions
+    L = (G.T @ diags(np.repeat(areas, 3)) @ G).tocsc()
+    
+    # Lumped mass matrix, every vertex gets a third of its adjacent face areas
+    mass = np.bincount(triangles.ravel(), weights=np.repeat(areas / 3.0, 3), minlength=count)
+    mass = np.maximum(mass, 1e-12)
+    
+    edges = coords[triangles] - coords[triangles[:, [1, 2, 0]]]
+    h = np.linalg.norm(edges, axis=2).mean() if len(triangles) > 0 else 1.0
+    t = heat_time_factor * h * h
+    
+    # Poisson system is only defined up to a constant per part, a tiny mass term pins that down
+    heat = splu((diags(mass) + t * L).tocsc())
+    poisson = splu((L + 1e-8 * diags(mass)).tocsc())
+    
+    adjacency = csr_matrix((np.ones(len(triangles) * 3), (triangles.ravel(), triangles[:, [1, 2, 0]].ravel())), shape=(count, count))
+    _, components = connected_components(adjacency, directed=False)
+    
+    solver = GeodesicSolver(heat, poisson, G, areas, components)
+    with cache_lock:
+        geodesic_cache[key] = solver
+        while len(geodesic_cache) > harmonic_cache_size:
+            geodesic_cache.popitem(last=False)
+    return solver
+
+def geodesic_distances(solver, sources, limit):
+    """Heat method distances from the given source vertices, capped at limit. Seed offsets aren't supported here."""
+    
+    count = len(solver.components)
+    d = np.full(count, limit)
+    if len(sources) == 0:
+        return d
+    
+    # Diffuse heat from the sources for a short time
+    delta = np.zeros(count)
+    delta[sources] = 1.0
+    u = solver.heat.solve(delta)
+    
+    # Distance grows opposite to the heat gradient, find the field best matching those unit directions
+    X = -(solver.gradient @ u).reshape(-1, 3)
+    X /= np.maximum(np.linalg.norm(X, axis=1), 1e-300)[:, None]
+    phi = solver.poisson.solve(solver.gradient.T @ (np.repeat(solver.areas, 3) * X.ravel()))
+    
+    # Solutions are up to a constant per connected part, parts without sources stay at limit
+    for component in np.unique(solver.components[sources]):
+        part = solver.components == component
+        d[part] = phi[part] - phi[sources[solver.components[sources] == component]].min()
+    return np.clip(d, 0.0, limit)
+
+####################################################################################################
+########################################## LIVE PREVIEW ############################################
+####################################################################################################
+
+# Object colorized together with others, its vertices are the stitched vertices at vertices.
+# Colors go to the vertex color layer color_layer, or to a point attribute of that name if attribute_type is set.
+Target = namedtuple("Target", ["object", "loops", "color_layer", "uv_layer", "vertices", "attribute_type"])
+
+# Everything needed to re-blend objects without path finding, kept from their last colorization
+BlendState = namedtuple("BlendState", ["names", "D", "owner", "targets", "weighting", "solver", "proxy"])
+
+blend_states = {} # Blend state of the last colorization only, keyed by every object colorized in it
+
+def target_valid(target):
+    """Whether an object can still be written to with a target from before"""
+    
+    obj = bpy.data.objects.get(target.object)
+    if obj is None or len(obj.data.loops) != len(target.loops) or target.uv_layer not in obj.data.uv_layers:
+        return False
+    
+    # Missing attributes just get added again
+    if target.attribute_type:
+        attribute = obj.data.attributes.get(target.color_layer)
+        return attribute is None or (attribute.domain == 'POINT' and attribute.data_type in ('FLOAT_COLOR', 'BYTE_COLOR'))
+    return target.color_layer in obj.data.vertex_colors
+
+def write_targets(targets, C, options):
+    """Writes stitched output colors back to every object"""
+    
+    for target in targets:
+        data = bpy.data.objects[target.object].data
+        
+        # Point attributes take one color per vertex instead of one per loop
+        if target.attribute_type:
+            write_point_colors(point_color_attribute(data, target.color_layer, target.attribute_type), C[target.vertices], options)
+            write_layers(None, data.uv_layers[target.uv_layer], target.loops, C[target.vertices], options)
+        else:
+            write_layers(data.vertex_colors[target.color_layer], data.uv_layers[target.uv_layer], target.loops, C[target.vertices], options)
+        data.update()
+
+def live_blend():
+    """Timer callback re-blending the active object from its last distance fields with current group colors"""
+    
+    obj = bpy.context.active_object
+    state = blend_states.get(obj.name) if obj else None
+    if state is None:
+        return None
+    
+    # Objects, layers or groups might have been removed since, needs a proper re-run then
+    colorizations = bpy.context.scene.tgor_vertex_colorizations
+    if not all(target_valid(target) for target in state.targets) or any(name not in colorizations for name in state.names):
+        return None
+    
+    O, W = group_colors(colorizations, state.names)
+    if state.weighting == 'HARM':
+        C = blend_colors(state.D, W, O, state.owner, state.weighting, state.solver, state.proxy)
+    else:
+        # Same chunks as the job, blending temporaries are several times the size of D otherwise
+        count = len(state.owner)
+        C = np.empty((count, 6))
+        for start in range(0, count, blend_chunk):
+            end = min(start + blend_chunk, count)
+            C[start:end] = blend_colors(state.D[:, start:end], W, O, state.owner[start:end], state.weighting)
+    write_targets(state.targets, C, bpy.context.scene.tgor_vertex_options)
+    return None
+
+####################################################################################################
+############################################## JOB #################################################
+####################################################################################################
+
+# Vertex clusters of an approximated mesh and which group owns each cluster
+ProxyState = namedtuple("ProxyState", ["clusters", "owner"])
+
+blend_chunk = 16384 # Vertices blended per step
+modal_time_slice = 0.03 # Seconds of work per timer event when colorizing in the background
+deviation_sample = 65536 # Vertices around the seeds of the first group measured exactly when approximating
+
+def seed_region(coords, triangles, distances, vertices, size):
+    """Picks the size vertices closest to the seed vertices by the given distances.
+    Returns them with the triangles between them and the seed vertices, both indexing into the region.
+    """
+    
+    count = len(coords)
+    if count <= size:
+        return np.arange(count), triangles, vertices
+    
+    inside = np.zeros(count, dtype=bool)
+    inside[np.argpartition(distances, size - 1)[:size]] = True
+    inside[vertices] = True
+    region = np.flatnonzero(inside)
+    
+    remap = np.full(count, -1, dtype=np.int32)
+    remap[region] = np.arange(len(region), dtype=np.int32)
+    local = remap[triangles[np.all(inside[triangles], axis=1)]]
+    return region, local, remap[vertices]
+
+class ColorizeJob:
+    """Path finding and blending for one object, no bpy in here so it can run off the main thread"""
+    
+    def __init__(self, name, coords, triangles, seeds, limit, names, owner, O, W, weighting, workers=1, method='GRAPH', resolution=1.0):
+        self.name = name
+        self.coords = coords
+        self.triangles = triangles
+        self.seeds = seeds
+        self.limit = limit
+        self.names = names
+        self.owner = owner
+        self.O = O
+        self.W = W
+        self.weighting = weighting
+        self.workers = workers
+        self.method = method
+        self.resolution = resolution
+        
+        self.progress = 0.0
+        self.cancelled = False
+        self.done = False
+        self.error = None
+        self.D = None # Vertex min path distances for each group
+        self.C = None # Output Colors
+        self.solver = None # Factorized Laplacian for harmonic weighting
+        self.proxy = None # Clusters when approximating
+        self.deviation = None # Mean and max distance error of an approximated group against exact
+    
+    def steps(self):
+        """Does the work in small steps, yielding progress from 0 to 1"""
+        
+        coords, triangles, seeds, owner = self.coords, self.triangles, self.seeds, self.owner
+        
+        # Approximations run on a clustered proxy mesh and get mapped back to every vertex after
+        if self.resolution < 1.0:
+            proxy = cluster_vertices(self.coords, self.triangles, self.resolution)
+            coords, triangles = proxy.coords, proxy.triangles
+            seeds = [proxy_seeds(proxy, vertices, offsets) for vertices, offsets in self.seeds]
+            
+            owned = np.flatnonzero(self.owner >= 0)
+            owner = np.full(len(coords), -1, dtype=np.int32)
+            owner[proxy.clusters[owned]] = self.owner[owned]
+            self.proxy = ProxyState(proxy.clusters, owner)
+            yield 0.05
+        
+        # Harmonic weighting is a single sparse solve without any path finding
+        if self.weighting == 'HARM':
+            self.solver = harmonic_solver(coords, triangles, np.flatnonzero(owner >= 0))
+            yield 0.8
+            self.C = blend_colors(None, self.W, self.O, self.owner, self.weighting, self.solver, self.proxy)
+            self.done = True
+            yield 1.0
+            return
+        
+        # Build shortest paths for each group, unchanged groups on an unchanged mesh come from cache
+        self.D = np.empty((len(seeds), len(coords)), dtype=np.float32)
+        for f in group_distances(self.D, self.name, coords, triangles, seeds, self.limit, self.workers, self.method):
+            yield 0.8 * f
+        
+        if self.proxy is not None:
+            
+            # Every vertex is as far away as its cluster plus the way to its center
+            self.D = np.minimum(self.D[:, proxy.clusters] + proxy.offsets, self.limit)
+            
+            # Measure against exact distances of the same kind for the first group, only around its seeds since
+            # a whole exact group costs about as much as not approximating. Paths to the inner half of that region
+            # shouldn't leave it, so only those are compared.
+            if len(seeds) > 0:
+                vertices, offsets = self.seeds[0]
+                region, local, sources = seed_region(self.coords, self.triangles, self.D[0], vertices, deviation_sample)
+                if self.method == 'HEAT':
+                    exact = geodesic_distances(geodesic_solver(self.coords[region], local), sources, self.limit)
+                else:
+                    exact = np.empty((1, len(region)), dtype=np.float32)
+                    for _ in distance_fields(exact, [0], self.coords[region], local, [(sources, offsets)], self.limit):
+                        pass
+                    exact = exact[0]
+                
+                inner = exact <= 0.5 * self.D[0][region].max() if len(region) < len(self.coords) else slice(None)
+                error = np.abs(self.D[0][region][inner] - exact[inner]) / max(self.limit, 1e-12)
+                if error.size > 0:
+                    self.deviation = (float(error.mean()), float(error.max()))
+            yield 0.8
+        
+        # Every vertex blends independently, so blending can be split into chunks
+        count = len(self.owner)
+        self.C = np.empty((count, 6))
+        for start in range(0, count, blend_chunk):
+            end = min(start + blend_chunk, count)
+            self.C[start:end] = blend_colors(self.D[:, start:end], self.W, self.O, self.owner[start:end], self.weighting)
+            yield 0.8 + 0.2 * end / count
+        
+        self.done = True
+    
+    def run(self):
+        """Runs all steps until done or cancelled, meant for a worker thread"""
+        
+        # Closing the steps right away releases worker pools and shared memory of path finding
+        steps = self.steps()
+        try:
+            for self.progress in steps:
+                if self.cancelled:
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            steps.close()
+
 ####################################################################################################
 ########################################### OPERATOR ###############################################
 ####################################################################################################
@@ -104,13 +783,14 @@ class TGOR_OT_ColorizeVertices(Operator):
     bl_idname = "scene.tgor_colorize_operator"
     bl_description = "Colorize according to assigned vertex groups"
     
-    iterations: IntProperty(default=20, min=1)
+    limit: FloatProperty(default=0.0, min=0.0, subtype='DISTANCE', description="Maximum path distance to propagate, zero uses the largest object dimension")
     color_selection: StringProperty()
     uv_selection: StringProperty()
     weighting : EnumProperty(
         items=(
             ('POLY', 'Polynomial', "Polynomial interpolation"),
-            ('LAPL', 'Laplacian', "Laplacian interpolation")
+            ('LAPL', 'Inverse Distance', "Inverse distance interpolation"),
+            ('HARM', 'Harmonic', "Smooth interpolation solving the mesh Laplacian, needs SciPy")
         ),
         name="Weighting algorithm",
         description="Choose weight algorithm",
@@ -118,6 +798,39 @@ class TGOR_OT_ColorizeVertices(Operator):
         update=None,
         get=None,
         set=None)
+    seeding : EnumProperty(
+        items=(
+            ('THRESHOLD', 'Threshold', "Vertices weighted above threshold are group members"),
+            ('WEIGHT', 'Weight', "Vertex weights are seed strengths, lower weights start further away")
+        ),
+        name="Seeding",
+        description="Choose how vertex group weights seed the groups",
+        default='THRESHOLD')
+    threshold: FloatProperty(default=0.1, min=0.0, max=1.0, description="Minimum weight for a vertex to be a group member")
+    distances : EnumProperty(
+        items=(
+            ('GRAPH', 'Edge Paths', "Shortest paths along mesh edges"),
+            ('HEAT', 'Geodesic', "Surface geodesics with the heat method, needs SciPy and ignores soft seed weights")
+        ),
+        name="Distances",
+        description="Choose how distances to groups are measured",
+        default='GRAPH')
+    background: BoolProperty(default=True, description="Keep the interface responsive while computing, cancel with Esc")
+    threaded: BoolProperty(default=False, description="Compute on a worker thread instead of in time slices, responsive even during long steps")
+    workers: IntProperty(default=1, min=1, max=64, description="Groups to compute in parallel on worker processes")
+    resolution: FloatProperty(default=1.0, min=0.01, max=1.0, subtype='FACTOR', description="Approximate on a clustered mesh with about this fraction of vertices, 1 computes exactly")
+    output : EnumProperty(
+        items=(
+            ('LOOP', 'Vertex Colors', "Per face corner vertex color layer, for exporters that need it"),
+            ('FLOAT_COLOR', 'Float Attribute', "Per vertex float color attribute"),
+            ('BYTE_COLOR', 'Byte Attribute', "Per vertex byte color attribute")
+        ),
+        name="Output",
+        description="Choose where colors are written to, UVs always go to the UV layer",
+        default='LOOP')
+    attribute: StringProperty(default="Colorization", description="Color attribute to write to, added where missing")
+    selected: BoolProperty(default=False, description="Colorize all selected meshes as one, stitched where their vertices coincide")
+    stitch_distance: FloatProperty(default=0.0001, min=0.0, subtype='DISTANCE', description="Vertices of different meshes closer than this are stitched together")
         
     def check(self, context):
         return True
@@ -140,147 +853,258 @@ class TGOR_OT_ColorizeVertices(Operator):
         
         row = layout.row()
         row.prop(self, "weighting", text="Weighting")
-        row.prop(self, "iterations", text="Iterations")
-        layout.prop_search(self, "color_selection", context.active_object.data, "vertex_colors", text="", icon='COLOR')
+        row.prop(self, "limit", text="Limit")
+        row = layout.row()
+        row.prop(self, "seeding", text="Seeding")
+        if self.seeding == 'THRESHOLD':
+            row.prop(self, "threshold", text="Threshold")
+        if self.weighting != 'HARM':
+            layout.prop(self, "distances", text="Distances")
+        layout.prop(self, "resolution", text="Resolution")
+        row = layout.row()
+        row.prop(self, "selected", text="Selected Meshes")
+        if self.selected:
+            row.prop(self, "stitch_distance", text="Stitch")
+        row = layout.row()
+        row.prop(self, "output", text="")
+        if self.output == 'LOOP':
+            row.prop_search(self, "color_selection", context.active_object.data, "vertex_colors", text="", icon='COLOR')
+        else:
+            row.prop(self, "attribute", text="", icon='COLOR')
         layout.prop_search(self, "uv_selection", context.active_object.data, "uv_layers", text="", icon='COLOR')
+        row = layout.row()
+        row.prop(self, "workers", text="Workers")
+        row.prop(self, "background", text="Background")
+        if self.background:
+            row.prop(self, "threaded", text="Threaded")
         
-    
-    def execute(self, context):
+    def prepare(self, context):
+        """Reads everything needed from the active (and selected) objects, returns None if there is nothing to colorize"""
         
-        # Decide which vertex color map to use
-        vertex_color = context.active_object.data.vertex_colors.active
-        if self.color_selection in context.active_object.data.vertex_colors:
-            vertex_color = context.active_object.data.vertex_colors[self.color_selection]
-
-        if not vertex_color:
-            self.report({'ERROR_INVALID_INPUT'}, "No vertex color selected or active")
-            return {'FINISHED'}
+        if self.weighting == 'HARM' and not splu:
+            self.report({'ERROR'}, "Harmonic weighting needs SciPy installed in Blender's python")
+            return None
         
-        vertex_uv = context.active_object.data.uv_layers.active
-        if self.uv_selection in context.active_object.data.uv_layers:
-            vertex_uv = context.active_object.data.uv_layers[self.uv_selection]
-
-        if not vertex_uv:
-            self.report({'ERROR_INVALID_INPUT'}, "No vertex UV selected or active")
-            return {'FINISHED'}
-
-        # Extract enabled groups
-        colorizations = {key: value for key,value in context.scene.tgor_vertex_colorizations.items()
-                         if key in context.active_object.vertex_groups and value.enabled == True}
+        if self.distances == 'HEAT' and not splu:
+            self.report({'ERROR'}, "Geodesic distances need SciPy installed in Blender's python")
+            return None
         
-        diameter = max(context.active_object.dimensions)
-        count = len(context.active_object.data.vertices)
+        # Extract enabled groups, selected meshes without any just don't seed anything
+        objects = [context.active_object]
+        if self.selected:
+            objects += [obj for obj in context.selected_objects if obj.type == 'MESH' and obj is not context.active_object]
         
-        # Triangulate
-        context.active_object.data.calc_loop_triangles()
+        colorizations = {key: value for key,value in context.scene.tgor_vertex_colorizations.items()
+                         if any(key in obj.vertex_groups for obj in objects) and value.enabled == True}
+        names = list(colorizations.keys())
+        if len(names) == 0:
+            self.report({'ERROR_INVALID_INPUT'}, "No enabled colorized group on any of the meshes")
+            return None
         
-        # Establish mesh relations
-        E = set() # Triangulation edges
-        V = [[]] * count # Triangulation edges
-        for triangle in context.active_object.data.loop_triangles:
-            for (i, j) in [(0, 1), (1, 2), (2,0)]:
-                u = triangle.vertices[i]
-                v = triangle.vertices[j]
-                
-                uc = context.active_object.data.vertices[u].co
-                vc = context.active_object.data.vertices[v].co
-                w = (uc-vc).length
-                
-                E.add((u, v, w))
-                V[u].append((v, w))
-        
-        # Build groups
-        U = set() # All vertices outside of groups
-        G = {key: [] for key in colorizations} # Vertices per group
-        for vertex in context.active_object.data.vertices:
-            U.add(vertex.index)   
-            for group in vertex.groups:
-                if group.weight > 0.1:
-                    name = context.active_object.vertex_groups[group.group].name
-                    if name in colorizations:
-                        G[name].append(vertex.index)
-                        U.remove(vertex.index)
-                        break
+        # Triangulate and fetch everything we need in bulk, in world space so objects line up
+        coords, triangles, loops, weights, layers = [], [], [], [], []
+        for obj in objects:
+            
+            # Decide which vertex color map to use, same names as on the active object or active ones
+            if self.output != 'LOOP':
+                color_layer = self.attribute
+                attribute = obj.data.attributes.get(color_layer)
+                if attribute and (attribute.domain != 'POINT' or attribute.data_type not in ('FLOAT_COLOR', 'BYTE_COLOR')):
+                    self.report({'ERROR_INVALID_INPUT'}, "Attribute %s on %s isn't a vertex color attribute" % (color_layer, obj.name))
+                    return None
+            else:
+                vertex_color = obj.data.vertex_colors.active
+                if self.color_selection in obj.data.vertex_colors:
+                    vertex_color = obj.data.vertex_colors[self.color_selection]
                 
-        # Build shortest paths for each group
-        C = [Vector((0,0,0,1,0,0))] * count # Output Colors
-        D = {} # Vertex min path distances for each group
-        W = {} # Weight for each group
-        O = {} # output color for each group
-        for name, group_vertices in G.items():
+                if not vertex_color:
+                    self.report({'ERROR_INVALID_INPUT'}, "No vertex color selected or active on " + obj.name)
+                    return None
+                color_layer = vertex_color.name
             
-            d = [diameter] * count
+            vertex_uv = obj.data.uv_layers.active
+            if self.uv_selection in obj.data.uv_layers:
+                vertex_uv = obj.data.uv_layers[self.uv_selection]
             
-            for group_vertex in group_vertices:
-                colorization = colorizations[name]
-                
-                color = Vector((colorization.red, colorization.green, colorization.blue, colorization.alpha, colorization.UVu, colorization.UVv))
-                C[group_vertex] = O[name] = color
-                W[name] = colorization.weight
-                
-                # Start every vertex from the group with zero weight
-                d[group_vertex] = 0.0
+            if not vertex_uv:
+                self.report({'ERROR_INVALID_INPUT'}, "No vertex UV selected or active on " + obj.name)
+                return None
             
-            # Execute bellman-ford algorithm for each vertex (CPU go brrrr)
-            for i in range(1, self.iterations):
-                for u, v, w in E:
-                    t = d[u] + w
-                    if t < d[v]:
-                        d[v] = t
-                        
-            D[name] = d
+            co, tris, lps = read_mesh(obj.data)
+            matrix = np.array(obj.matrix_world, dtype=np.float32)
+            coords.append(co @ matrix[:3, :3].T + matrix[:3, 3])
+            triangles.append(tris)
+            loops.append(lps)
+            weights.append(read_group_weights(obj, names))
+            layers.append((color_layer, vertex_uv.name))
         
-        # Build vertex colors for yet unassigned vertices
-        for u in U:
-            
-            if self.weighting == 'POLY':
-                c = Vector((0,0,0,0,0,0))
-                for name in G:
-                    
-                    d = D[name][u] / W[name]
-                    
-                    f = 1.0
-                    for other in G:
-                        if other != name:
-                            e = D[other][u] / W[other]
-                            f *= e / (d + e)
-                            
-                    c += O[name] * f
-                
-                C[u] = c
-                
-            else:
-                w = 0.0
-                c = Vector((0,0,0,0,0,0))
-                for name in G:
-                    
-                    d = D[name][u]
-                    
-                    f = W[name] / max(d, 0.0001) # Avoid division by zero
-                    c += O[name] * f
-                    w += f
-                
-                if w > 0.0001:
-                    C[u] = c / w
+        # Single graph over all objects, seams joined where vertices coincide
+        vertex_starts = np.cumsum([0] + [len(co) for co in coords])
+        stitched = stitch_meshes(coords, triangles, self.stitch_distance if len(objects) > 1 else 0.0)
+        coords, triangles = stitched.coords, stitched.triangles
+        count = len(coords)
+        
+        diameter = float((coords.max(axis=0) - coords.min(axis=0)).max()) if count > 0 else 0.0
+        if self.limit > 0.0:
+            diameter = self.limit
+        
+        # Seed weights of all enabled groups on stitched vertices
+        weights = Weights(stitched.merged[np.concatenate([w.vertices + start for w, start in zip(weights, vertex_starts)])],
+                          np.concatenate([w.groups for w in weights]), np.concatenate([w.weights for w in weights]))
+        
+        # Hard seeds are members above threshold, soft seeds are all weighted vertices starting further away the lower their weight.
+        # Only fully weighted vertices are members when seeding softly, everything else is blended.
+        if self.seeding == 'WEIGHT':
+            seeded = weights.weights > 0.0
+            members = weights.weights >= 1.0
+            offsets = (1.0 - weights.weights) * diameter
+        else:
+            seeded = members = weights.weights > self.threshold
+            offsets = np.zeros(len(weights.weights), dtype=np.float32)
+        
+        # Groups without any seeds have nothing to propagate
+        present = np.unique(weights.groups[seeded])
+        names = [names[i] for i in present]
+        remap = np.full(len(colorizations), -1, dtype=np.int32)
+        remap[present] = np.arange(len(present))
+        
+        # Vertices are owned by the group they're weighted strongest in
+        strongest = np.zeros(count, dtype=np.float32)
+        np.maximum.at(strongest, weights.vertices[members], weights.weights[members])
+        top = members & (weights.weights >= strongest[weights.vertices])
+        owner = np.full(count, -1, dtype=np.int32)
+        owner[weights.vertices[top]] = remap[weights.groups[top]]
+        
+        # Group colors and weights
+        O, W = group_colors(colorizations, names)
+        
+        # Seeds of each group, stitched vertices can be seeded from several objects
+        seeds = []
+        for group in present:
+            mask = seeded & (weights.groups == group)
+            vertices, group_offsets = weights.vertices[mask], offsets[mask]
+            order = np.lexsort((group_offsets, vertices))
+            vertices, first = np.unique(vertices[order], return_index=True)
+            seeds.append((vertices, group_offsets[order][first]))
+        
+        # Remember where to write to once done
+        self._object = context.active_object.name
+        attribute_type = self.output if self.output != 'LOOP' else None
+        self._targets = [Target(obj.name, lps, color_layer, uv_layer, stitched.merged[start:end], attribute_type)
+                         for obj, lps, (color_layer, uv_layer), start, end in zip(objects, loops, layers, vertex_starts, vertex_starts[1:])]
+        
+        return ColorizeJob(context.active_object.name, coords, triangles, seeds, diameter, names, owner, O, W, self.weighting, self.workers, self.distances, self.resolution)
+    
+    def finish(self, context):
+        """Writes the output of a finished job, the mesh might have changed if this ran in the background"""
+        
+        if not all(target_valid(target) for target in self._targets):
+            self.report({'ERROR'}, "Mesh or layers changed while colorizing")
+            return {'CANCELLED'}
         
         # Actually set the color according to defined mask
-        for loop in context.active_object.data.loops:
-            if context.scene.tgor_vertex_options.red:
-                vertex_color.data[loop.index].color[0] = C[loop.vertex_index][0]
-            if context.scene.tgor_vertex_options.green:
-                vertex_color.data[loop.index].color[1] = C[loop.vertex_index][1]
-            if context.scene.tgor_vertex_options.blue:
-                vertex_color.data[loop.index].color[2] = C[loop.vertex_index][2]
-            if context.scene.tgor_vertex_options.alpha:
-                vertex_color.data[loop.index].color[3] = C[loop.vertex_index][3]
-            if context.scene.tgor_vertex_options.UVu:
-                vertex_uv.data[loop.index].uv[0] = C[loop.vertex_index][4]
-            if context.scene.tgor_vertex_options.UVv:
-                vertex_uv.data[loop.index].uv[1] = C[loop.vertex_index][5]
+        job = self._job
+        write_targets(self._targets, job.C, context.scene.tgor_vertex_options)
         
-                        
+        # Keep distances around so edits to group colors can be previewed live, for the last run only since
+        # they hold a full field per group and aren't part of cache_budget
+        state = BlendState(job.names, job.D, job.owner, self._targets, job.weighting, job.solver, job.proxy)
+        blend_states.clear()
+        for target in self._targets:
+            blend_states[target.object] = state
+        
+        if job.proxy is not None:
+            message = "Approximated %d vertices with %d clusters" % (len(job.proxy.clusters), len(job.proxy.owner))
+            if job.deviation:
+                message += ", distance error mean %.2f%% max %.2f%% of limit around the seeds of group %s" % (job.deviation[0] * 100, job.deviation[1] * 100, job.names[0])
+            elif job.weighting == 'HARM':
+                # A harmonic solution depends on the whole mesh, checking it would take a full exact solve
+                message += ", no deviation measured for harmonic weighting"
+            self.report({'INFO'}, message)
         return {'FINISHED'}
     
+    def execute(self, context):
+        
+        self._job = self.prepare(context)
+        if not self._job:
+            return {'FINISHED'}
+        
+        if not self.background or bpy.app.background or not context.window:
+            for _ in self._job.steps():
+                pass
+            return self.finish(context)
+        
+        # Work gets done on timer events, either right in modal or on a worker thread
+        if self.threaded:
+            self._thread = threading.Thread(target=self._job.run, daemon=True)
+            self._thread.start()
+        else:
+            self._steps = self._job.steps()
+        
+        wm = context.window_manager
+        wm.progress_begin(0.0, 1.0)
+        self._timer = wm.event_timer_add(0.05, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        
+        # Nothing has been written yet, so the layers stay untouched
+        if event.type == 'ESC':
+            self._job.cancelled = True
+            self.cleanup(context)
+            self.report({'INFO'}, "Colorization cancelled")
+            return {'CANCELLED'}
+        
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        
+        if self.threaded:
+            if self._thread.is_alive():
+                self.update_progress(context)
+                return {'RUNNING_MODAL'}
+        else:
+            # Work for a time slice per timer event
+            deadline = time.perf_counter() + modal_time_slice
+            try:
+                while time.perf_counter() < deadline:
+                    self._job.progress = next(self._steps)
+            except StopIteration:
+                pass
+            except Exception as e:
+                self._job.error = e
+            
+            if not self._job.done and not self._job.error:
+                self.update_progress(context)
+                return {'RUNNING_MODAL'}
+        
+        self.cleanup(context)
+        if self._job.error:
+            self.report({'ERROR'}, "Colorization failed: " + str(self._job.error))
+            return {'CANCELLED'}
+        return self.finish(context)
+    
+    def update_progress(self, context):
+        context.window_manager.progress_update(self._job.progress)
+        context.workspace.status_text_set("Colorizing %s: %d%% (Esc to cancel)" % (self._object, int(self._job.progress * 100)))
+    
+    def cancel(self, context):
+        
+        # Blender aborting the modal operator, e.g. when closing the file
+        self._job.cancelled = True
+        self.cleanup(context)
+    
+    def cleanup(self, context):
+        
+        # Path finding might still hold worker pools and shared memory, the worker thread closes its own steps
+        if not self.threaded:
+            self._steps.close()
+        
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+    
 ####################################################################################################
 ############################################ UIList ################################################
 ####################################################################################################
@@ -352,6 +1176,7 @@ class TGOR_PT_VertexColorizationPanel(Panel):
         if len(context.scene.tgor_vertex_colorizations) > 0:
             row = col.row(align=True)
             row.operator("scene.tgor_colorize_operator", text="Colorize Vertex Groups")
+            row.prop(context.scene, "tgor_vertex_live", text="Live", toggle=True)
         
         col = row.column(align=True)
         
@@ -382,9 +1207,20 @@ def register():
     bpy.types.Scene.tgor_vertex_colorizations = CollectionProperty(type=TGOR_VertexColorizationEntry)
     bpy.types.Scene.tgor_vertex_colorization_index = IntProperty()
     bpy.types.Scene.tgor_vertex_options = PointerProperty(type=TGOR_VertexColorizationOptions)
+    bpy.types.Scene.tgor_vertex_live = BoolProperty(default=False, description="Re-blend the last colorization while editing group colors and weights")
+    
+    bpy.app.handlers.save_post.append(save_distance_cache)
+    bpy.app.handlers.load_post.append(load_distance_cache)
 
 def unregister():
     
+    bpy.app.handlers.load_post.remove(load_distance_cache)
+    bpy.app.handlers.save_post.remove(save_distance_cache)
+    
+    if bpy.app.timers.is_registered(live_blend):
+        bpy.app.timers.unregister(live_blend)
+    
+    del bpy.types.Scene.tgor_vertex_live
     del bpy.types.Scene.tgor_vertex_options
     del bpy.types.Scene.tgor_vertex_colorization_index
     del bpy.types.Scene.tgor_vertex_colorizations
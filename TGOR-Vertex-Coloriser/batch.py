@@ -0,0 +1,212 @@
+# Headless batch colorization for the TGOR Vertex Coloriser.
+#
+# Inside Blender, colorizes every mesh of the opened file (or of one collection) with the colorization
+# settings stored in the scene or loaded from a JSON export, then saves the file:
+#   blender -b asset.blend --python batch.py -- [--collection Body] [--settings palette.json] [--weighting POLY]
+#
+# Outside Blender, runs that on many files at once, one background Blender process per file:
+#   python batch.py --blender /path/to/blender --jobs 4 [same options] assets/*.blend
+#
+# Settings of a configured file can be exported for the above with:
+#   blender -b configured.blend --python batch.py -- --export-settings palette.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+report_prefix = "TGOR_BATCH " # Marks lines the driver parses from Blender's output
+
+entry_keys = ("enabled", "red", "green", "blue", "alpha", "UVu", "UVv", "weight")
+option_keys = ("red", "green", "blue", "alpha", "UVu", "UVv")
+
+####################################################################################################
+############################################ SETTINGS ##############################################
+####################################################################################################
+
+def export_settings(scene):
+    """Colorization settings of a scene as JSON compatible dict"""
+
+    return {
+        "options": {key: getattr(scene.tgor_vertex_options, key) for key in option_keys},
+        "colorizations": [dict(name=entry.name, **{key: getattr(entry, key) for key in entry_keys}) for entry in scene.tgor_vertex_colorizations],
+    }
+
+def import_settings(scene, settings):
+    """Replaces colorization settings of a scene with the ones from export_settings"""
+
+    for key, value in settings.get("options", {}).items():
+        setattr(scene.tgor_vertex_options, key, value)
+
+    scene.tgor_vertex_colorizations.clear()
+    for values in settings.get("colorizations", []):
+        entry = scene.tgor_vertex_colorizations.add()
+        entry.name = values["name"]
+        for key in entry_keys:
+            if key in values:
+                setattr(entry, key, values[key])
+
+####################################################################################################
+############################################# BLENDER ##############################################
+####################################################################################################
+
+def ensure_addon():
+    """Registers the addon from this folder unless it's enabled already"""
+
+    import bpy
+    import importlib.util
+
+    if hasattr(bpy.types.Scene, "tgor_vertex_colorizations"):
+        return
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location(os.path.basename(folder), os.path.join(folder, "__init__.py"), submodule_search_locations=[folder])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    module.register()
+
+def colorize_file(args):
+    """Colorizes all matching meshes of the currently opened file, prints one report line per object"""
+
+    import bpy
+
+    ensure_addon()
+    scene = bpy.context.scene
+
+    if args.export_settings:
+        with open(args.export_settings, "w") as file:
+            json.dump(export_settings(scene), file, indent=4)
+        return
+
+    if args.settings:
+        with open(args.settings) as file:
+            import_settings(scene, json.load(file))
+
+    if args.collection:
+        if args.collection not in bpy.data.collections:
+            print(report_prefix + json.dumps({"file": bpy.data.filepath, "error": "No collection " + args.collection}))
+            return
+        objects = bpy.data.collections[args.collection].all_objects
+    else:
+        objects = scene.objects
+
+    # Only meshes that actually have any of the colorized groups
+    names = {entry.name for entry in scene.tgor_vertex_colorizations if entry.enabled}
+    objects = [obj for obj in objects if obj.type == 'MESH' and any(group.name in names for group in obj.vertex_groups)]
+
+    for obj in objects:
+        report = {"file": bpy.data.filepath, "object": obj.name, "vertices": len(obj.data.vertices)}
+
+        if obj.name not in bpy.context.view_layer.objects:
+            report["error"] = "Not in the active view layer"
+        elif (args.output == 'LOOP' and not obj.data.vertex_colors.active) or not obj.data.uv_layers.active:
+            report["error"] = "No active vertex color or UV layer"
+        else:
+            bpy.context.view_layer.objects.active = obj
+
+            # Operator errors raise here, they shouldn't stop the other objects from being colorized
+            start = time.perf_counter()
+            try:
+                result = bpy.ops.scene.tgor_colorize_operator(weighting=args.weighting, seeding=args.seeding, threshold=args.threshold,
+                                                               limit=args.limit, workers=args.workers, background=False, selected=False, output=args.output,
+                                                               distances=args.distances, resolution=args.resolution)
+                report["result"] = sorted(result)
+            except RuntimeError as e:
+                report["error"] = str(e).strip()
+            report["seconds"] = time.perf_counter() - start
+
+        print(report_prefix + json.dumps(report))
+
+    if len(objects) > 0 and not args.dry_run:
+        bpy.ops.wm.save_mainfile()
+
+####################################################################################################
+############################################# DRIVER ###############################################
+####################################################################################################
+
+def run_file(args, path, forwarded):
+    """Colorizes one file in a background Blender process, returns its reports and wall time"""
+
+    start = time.perf_counter()
+    process = subprocess.run([args.blender, "-b", path, "--python-exit-code", "1", "--python", os.path.abspath(__file__), "--"] + forwarded,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    seconds = time.perf_counter() - start
+
+    reports = [json.loads(line[len(report_prefix):]) for line in process.stdout.splitlines() if line.startswith(report_prefix)]
+    if process.returncode != 0:
+        reports.append({"file": path, "error": "Blender exited with code %d" % process.returncode})
+    return path, reports, seconds
+
+def run_files(args, forwarded):
+    """Colorizes all files in parallel and prints a timing summary"""
+
+    total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(lambda path: run_file(args, path, forwarded), args.files))
+
+    failed = 0
+    for path, reports, seconds in results:
+        print("%s (%.2fs)" % (path, seconds))
+        for report in reports:
+            if "error" in report:
+                failed += 1
+                print("    %-32s ERROR %s" % (report.get("object", ""), report["error"]))
+            else:
+                print("    %-32s %8d vertices %8.2fs" % (report["object"], report["vertices"], report["seconds"]))
+
+    print("%d files in %.2fs, %d errors" % (len(results), time.perf_counter() - total, failed))
+    return 1 if failed > 0 else 0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Colorize vertex groups of meshes in .blend files")
+    parser.add_argument("files", nargs="*", help="Files to colorize, only when running outside of Blender")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Files to process in parallel")
+    parser.add_argument("--collection", help="Only colorize meshes in this collection")
+    parser.add_argument("--settings", help="JSON export of colorization settings to use instead of the stored ones")
+    parser.add_argument("--export-settings", help="Write the stored colorization settings to this JSON file and exit")
+    parser.add_argument("--weighting", default='LAPL', choices=('POLY', 'LAPL', 'HARM'), help="HARM needs SciPy in Blender's python")
+    parser.add_argument("--distances", default='GRAPH', choices=('GRAPH', 'HEAT'), help="HEAT needs SciPy in Blender's python")
+    parser.add_argument("--seeding", default='THRESHOLD', choices=('THRESHOLD', 'WEIGHT'))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--limit", type=float, default=0.0)
+    parser.add_argument("--resolution", type=float, default=1.0, help="Approximate on about this fraction of vertices, 1 computes exactly")
+    parser.add_argument("--workers", type=int, default=1, help="Groups to compute in parallel per object")
+    parser.add_argument("--output", default='LOOP', choices=('LOOP', 'FLOAT_COLOR', 'BYTE_COLOR'), help="Vertex color layer or point color attribute")
+    parser.add_argument("--dry-run", action="store_true", help="Don't save colorized files")
+    return parser.parse_args(argv)
+
+def main():
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+
+    if bpy:
+        # Blender's own arguments come before --
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+        colorize_file(parse_args(argv))
+        return 0
+
+    args = parse_args(sys.argv[1:])
+
+    # Colorization options get passed on to every Blender process
+    forwarded = ["--weighting", args.weighting, "--seeding", args.seeding, "--threshold", str(args.threshold),
+                 "--limit", str(args.limit), "--workers", str(args.workers), "--output", args.output,
+                 "--distances", args.distances, "--resolution", str(args.resolution)]
+    if args.collection:
+        forwarded += ["--collection", args.collection]
+    if args.settings:
+        forwarded += ["--settings", os.path.abspath(args.settings)]
+    if args.dry_run:
+        forwarded.append("--dry-run")
+
+    return run_files(args, forwarded)
+
+if __name__ == "__main__":
+    sys.exit(main())
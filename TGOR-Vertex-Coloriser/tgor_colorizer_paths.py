@@ -0,0 +1,318 @@
+# Mesh graph and shortest path finding for the TGOR Vertex Coloriser.
+# Doesn't touch bpy so worker processes can import it, which they can't through the addon package.
+
+import numpy as np
+import heapq
+import itertools
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context, shared_memory
+
+# SciPy isn't shipped with Blender, use its compiled graph routines if someone installed it
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    dijkstra = None
+
+####################################################################################################
+############################################## GRAPH ###############################################
+####################################################################################################
+
+# Undirected mesh graph in CSR layout, neighbours of vertex u are indices[indptr[u]:indptr[u+1]].
+# Every edge is stored once per direction as int32 index and float32 length, a closed triangle mesh
+# has about 3 edges per vertex, making it ~52 bytes per vertex (~50MB for 1M vertices).
+# Building it peaks at about twice that for the edge keys and sorting.
+Graph = namedtuple("Graph", ["indptr", "indices", "weights"])
+
+def build_graph(coords, triangles):
+    """Builds the CSR graph of unique triangulation edges weighted by their length"""
+    
+    count = len(coords)
+    
+    # Every triangle edge as (smaller, larger) vertex index, shared edges collapse on unique
+    edges = np.sort(np.stack((triangles.ravel(), triangles[:, [1, 2, 0]].ravel()), axis=1), axis=1)
+    keys = np.unique(edges[:, 0].astype(np.int64) * count + edges[:, 1])
+    u = (keys // count).astype(np.int32)
+    v = (keys % count).astype(np.int32)
+    del edges, keys
+    
+    # Compute lengths once per edge and store both directions sorted by source vertex
+    w = np.linalg.norm(coords[u] - coords[v], axis=1).astype(np.float32)
+    rows = np.concatenate((u, v))
+    order = np.argsort(rows, kind='stable')
+    indices = np.concatenate((v, u))[order]
+    weights = np.concatenate((w, w))[order]
+    
+    indptr = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=count), out=indptr[1:])
+    return Graph(indptr, indices, weights)
+
+####################################################################################################
+############################################ STITCHING #############################################
+####################################################################################################
+
+# Several meshes joined into one, vertex u of the concatenated meshes is stitched vertex merged[u]
+Stitched = namedtuple("Stitched", ["merged", "coords", "triangles"])
+
+def coincident_pairs(coords, tolerance):
+    """All vertex pairs (i < j) closer than tolerance, hashed onto a grid of tolerance sized cells so
+    only vertices in the same or neighbouring cells get compared
+    """
+    
+    cells = np.floor(coords / tolerance).astype(np.int64)
+    cells -= cells.min(axis=0)
+    
+    # One padding cell per axis keeps neighbour keys from wrapping onto an existing cell
+    span = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+    order = np.argsort(keys, kind='stable')
+    ordered = keys[order]
+    
+    first, second = [], []
+    for dx, dy, dz in itertools.product((-1, 0, 1), repeat=3):
+        neighbours = keys + (dx * span[1] + dy) * span[2] + dz
+        start = np.searchsorted(ordered, neighbours, side='left')
+        counts = np.searchsorted(ordered, neighbours, side='right') - start
+        
+        # Expand every vertex' range of candidates in the sorted keys
+        i = np.repeat(np.arange(len(coords)), counts)
+        j = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)]
+        close = (i < j) & (np.linalg.norm(coords[i] - coords[j], axis=1) < tolerance)
+        first.append(i[close])
+        second.append(j[close])
+    
+    return np.concatenate(first), np.concatenate(second)
+
+def stitch_meshes(coords, triangles, tolerance):
+    """Joins meshes given as lists of coordinate and triangle arrays into one, vertices closer than tolerance become one"""
+    
+    starts = np.cumsum([0] + [len(c) for c in coords])
+    coords = np.concatenate(coords)
+    triangles = np.concatenate([t + start for t, start in zip(triangles, starts)]).astype(np.int32)
+    
+    # Every vertex gets the smallest index it's connected to through coincident pairs
+    label = np.arange(len(coords))
+    if tolerance > 0.0 and len(coords) > 0:
+        i, j = coincident_pairs(coords, tolerance)
+        while True:
+            low = np.minimum(label[i], label[j])
+            update = label.copy()
+            np.minimum.at(update, i, low)
+            np.minimum.at(update, j, low)
+            update = update[update]
+            if np.array_equal(update, label):
+                break
+            label = update
+    
+    representatives, merged = np.unique(label, return_inverse=True)
+    merged = merged.ravel().astype(np.int32)
+    
+    # Triangles collapsed by stitching carry no connectivity
+    mapped = merged[triangles]
+    mapped = mapped[(mapped[:, 0] != mapped[:, 1]) & (mapped[:, 1] != mapped[:, 2]) & (mapped[:, 2] != mapped[:, 0])]
+    return Stitched(merged, coords[representatives], mapped)
+
+####################################################################################################
+############################################## PROXY ###############################################
+####################################################################################################
+
+# Coarse stand-in for a dense mesh, vertex u of the full mesh is represented by proxy vertex clusters[u]
+Proxy = namedtuple("Proxy", ["clusters", "coords", "triangles", "offsets"])
+
+def cluster_vertices(coords, triangles, resolution):
+    """Clusters vertices on a voxel grid sized to keep about resolution of them, returns the proxy mesh.
+    Offsets are each vertex's distance to its cluster center, to be added to proxy distances.
+    """
+    
+    # Vertex density on a surface goes with the inverse square of edge length
+    edges = coords[triangles] - coords[triangles[:, [1, 2, 0]]]
+    voxel = np.linalg.norm(edges, axis=2).mean() / np.sqrt(resolution) if len(triangles) > 0 else 1.0
+    
+    cells = np.floor((coords - coords.min(axis=0)) / voxel).astype(np.int64)
+    _, clusters = np.unique(cells, axis=0, return_inverse=True)
+    clusters = clusters.ravel().astype(np.int32)
+    count = clusters.max() + 1 if len(clusters) > 0 else 0
+    
+    # Cluster centers are the mean of their vertices
+    sizes = np.bincount(clusters, minlength=count)
+    centers = np.stack([np.bincount(clusters, weights=coords[:, axis], minlength=count) for axis in range(3)], axis=1) / sizes[:, None]
+    centers = centers.astype(np.float32)
+    
+    # Triangles collapsed into an edge or point carry no more connectivity
+    mapped = clusters[triangles]
+    mapped = mapped[(mapped[:, 0] != mapped[:, 1]) & (mapped[:, 1] != mapped[:, 2]) & (mapped[:, 2] != mapped[:, 0])]
+    
+    offsets = np.linalg.norm(coords - centers[clusters], axis=1).astype(np.float32)
+    return Proxy(clusters, centers, mapped, offsets)
+
+def proxy_seeds(proxy, vertices, offsets):
+    """Moves seeds onto the proxy, every cluster keeps the smallest offset of its seeds"""
+    
+    clusters = proxy.clusters[vertices]
+    order = np.lexsort((offsets, clusters))
+    clusters = clusters[order]
+    first = np.ones(len(clusters), dtype=bool)
+    first[1:] = clusters[1:] != clusters[:-1]
+    return clusters[first], offsets[order][first]
+
+####################################################################################################
+######################################### SHORTEST PATHS ###########################################
+####################################################################################################
+
+def shortest_paths(graph, sources, offsets, limit):
+    """Multi-source dijkstra over a CSR graph of python lists, sources start at their offset and distances are capped at limit"""
+    
+    indptr, indices, weights = graph
+    d = [limit] * (len(indptr) - 1)
+    heap = []
+    for source, offset in zip(np.asarray(sources).tolist(), np.asarray(offsets).tolist()):
+        if offset < d[source]:
+            d[source] = offset
+            heap.append((offset, source))
+    heapq.heapify(heap)
+    
+    # Every vertex gets settled once, stops as soon as nothing closer than limit is left
+    while heap:
+        t, u = heapq.heappop(heap)
+        if t > d[u]:
+            continue # Stale entry, vertex was settled with a shorter path already
+        
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            s = t + weights[k]
+            if s < d[v]:
+                d[v] = s
+                heapq.heappush(heap, (s, v))
+    return d
+
+def shortest_paths_csgraph(graph, sources, offsets, limit):
+    """Multi-source dijkstra on a symmetric sparse matrix using scipy, sources start at their offset and distances are capped at limit"""
+    
+    count = graph.shape[0]
+    if len(sources) == 0:
+        return np.full(count, limit)
+    
+    if not np.any(offsets):
+        d = dijkstra(graph, directed=True, indices=sources, min_only=True, limit=limit)
+    else:
+        # Scipy can't start sources at different distances, so link them to an extra vertex with their offset as edge length
+        indptr = np.append(graph.indptr, graph.indptr[-1] + len(sources))
+        indices = np.concatenate((graph.indices, sources))
+        data = np.concatenate((graph.data, offsets))
+        augmented = csr_matrix((data, indices, indptr), shape=(count + 1, count + 1))
+        d = dijkstra(augmented, directed=True, indices=count, limit=limit)[:count]
+    
+    return np.minimum(d, limit) # Unreached vertices are reported as inf
+
+####################################################################################################
+############################################### POOL ###############################################
+####################################################################################################
+
+pool_poll = 0.01 # Seconds to wait for workers before yielding back to the caller
+
+# Graph per shared memory block, every worker process only converts it once
+process_graphs = {}
+
+def share_array(array):
+    """Copies an array into a new shared memory block, returns the block and its (name, shape, dtype) description"""
+    
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[...] = array
+    return memory, (memory.name, array.shape, array.dtype.str)
+
+def process_shortest_paths(graph, output, row, sources, offsets, limit):
+    """Process pool task, writes the distance field of one group into row of the shared output"""
+    
+    key = graph[0][0]
+    if key not in process_graphs:
+        arrays = []
+        for name, shape, dtype in graph:
+            memory = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+            arrays.append(array.copy() if dijkstra else array.tolist())
+            memory.close()
+        
+        process_graphs.clear() # Only ever keep the graph of the current run
+        if dijkstra:
+            indptr, indices, weights = arrays
+            count = len(indptr) - 1
+            process_graphs[key] = csr_matrix((weights, indices, indptr), shape=(count, count))
+        else:
+            process_graphs[key] = Graph(*arrays)
+    
+    name, shape, dtype = output
+    memory = shared_memory.SharedMemory(name=name)
+    if dijkstra:
+        distances = shortest_paths_csgraph(process_graphs[key], sources, offsets, limit)
+    else:
+        distances = shortest_paths(process_graphs[key], sources, offsets, limit)
+    np.ndarray(shape, dtype=dtype, buffer=memory.buf)[row] = distances
+    memory.close()
+
+def distance_fields(D, rows, coords, triangles, seeds, limit, workers=1):
+    """Fills the given rows of D with the distance fields of the matching (vertices, offsets) seeds.
+    Generator yielding each row once it's done and None after building the graph or while waiting on workers.
+    
+    With more than one worker groups are computed in parallel on processes sharing graph and output memory,
+    neither scipy's dijkstra nor the python fallback release the GIL so threads wouldn't help.
+    """
+    
+    graph = build_graph(coords, triangles)
+    count = len(coords)
+    
+    # Let scipy handle path finding if available, python lists are a lot faster to walk otherwise
+    if workers <= 1:
+        if dijkstra:
+            matrix = csr_matrix((graph.weights, graph.indices, graph.indptr), shape=(count, count))
+        else:
+            lists = Graph(*(array.tolist() for array in graph))
+    yield None
+    
+    # Start from every seed of the group at once, paths further than limit are cut off
+    if workers <= 1:
+        for row, (vertices, offsets) in zip(rows, seeds):
+            if dijkstra:
+                D[row] = shortest_paths_csgraph(matrix, vertices, offsets, limit)
+            else:
+                D[row] = shortest_paths(lists, vertices, offsets, limit)
+            yield row
+        return
+    
+    memories = []
+    shared = []
+    for array in graph:
+        memory, description = share_array(array)
+        memories.append(memory)
+        shared.append(description)
+    
+    # Workers write into their own output block, rows get copied into D as they finish
+    output = np.empty((len(rows), count), dtype=D.dtype)
+    memory, description = share_array(output)
+    memories.append(memory)
+    output = np.ndarray(output.shape, dtype=output.dtype, buffer=memory.buf)
+    
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+    pending = {pool.submit(process_shortest_paths, shared, description, i, vertices, offsets, limit): row
+               for i, (row, (vertices, offsets)) in enumerate(zip(rows, seeds))}
+    slots = {row: i for i, row in enumerate(rows)}
+    
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=pool_poll, return_when=FIRST_COMPLETED)
+            if len(done) == 0:
+                yield None
+            
+            for future in done:
+                row = pending.pop(future)
+                future.result() # Raises whatever went wrong in the worker
+                D[row] = output[slots[row]]
+                yield row
+    finally:
+        # Also gets here if the caller stops early, don't wait for the remaining groups then
+        pool.shutdown(wait=len(pending) == 0, cancel_futures=True)
+        output = None
+        for memory in memories:
+            memory.close()
+            memory.unlink()